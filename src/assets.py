@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+from kivy.graphics.texture import Texture
+from PIL import Image
+
+from constants import *
+
+# assets/ lives in the project root, next to src/. Built textures are cached in assets/cache/.
+ASSETS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'assets')
+CACHE_DIR = os.path.join(ASSETS_DIR, 'cache')
+CACHE_VERSION = 1  # Bump when the build output changes, so stale caches are not reused
+
+# Sprite id -> (file in assets/, size it is drawn at by SceneRenderer). All of them are packed into
+# one atlas texture, each scaled down to its draw size.
+SPRITES = {
+    "cannon": ("cannon.png", (150, 67)),
+    "pistol": ("pistol.png", (150, 50)),
+    "laser_gun": ("laser_gun.png", (150, 50)),
+    "table": ("cannon2.png", (86, 68)),
+    "enemy": ("enemy.png", (100, 100)),
+    "stone": ("stone.png", (100, 100)),
+    "mirror": ("mirror.png", (100, 100)),
+    "ball": ("ball.png", (35, 35)),
+    "bullet": ("bullet.png", (30, 20)),
+    "explosion": ("explosion.png", (100, 100)),
+    "perpetito": ("perpetito.webp", (100, 100)),
+    "sticker": ("sticker.webp", (100, 100)),
+}
+
+# Images too big to share the atlas get a texture of their own, scaled down to at most the window size.
+TEXTURES = {
+    "background": ("bg.jpg", (SCREEN_WIDTH, SCREEN_HEIGHT)),
+}
+
+ATLAS_WIDTH = 512
+ATLAS_PADDING = 4  # Transparent gap between sprites, so filtering never samples a neighbour
+ATLAS_ALIGN = 4  # Sprites start on multiples of this, keeping them apart in the first mipmap levels
+
+
+# Decodes an image to RGBA, scaled down (never up) to fit size. Sprites are stretched to their
+# draw size anyway, so each axis is scaled on its own.
+def decode(path, size):
+    image = Image.open(path).convert('RGBA')
+    target = (min(image.width, size[0]), min(image.height, size[1]))
+    if target != image.size:
+        image = image.resize(target, Image.LANCZOS)
+    return image
+
+
+def _align(value):
+    return -(-value // ATLAS_ALIGN) * ATLAS_ALIGN
+
+
+# Shelf packing: sprites go left to right in rows, tallest first, each row as tall as its first sprite.
+# Returns the top-left corner of each size (in input order) and the total height used.
+def pack(sizes, width=ATLAS_WIDTH, padding=ATLAS_PADDING):
+    corners = [None] * len(sizes)
+    x = y = shelf = 0
+    for i in sorted(range(len(sizes)), key=lambda i: -sizes[i][1]):
+        w, h = sizes[i]
+        if x + w > width:
+            x, y, shelf = 0, _align(y + shelf + padding), 0
+        corners[i] = (x, y)
+        x = _align(x + w + padding)
+        shelf = max(shelf, h)
+    return corners, y + shelf
+
+
+# Mipmap chain of an image, as RGBA arrays in texture row order (bottom row first), full size first.
+def mipmaps(image):
+    levels = []
+    while True:
+        levels.append(np.asarray(image.transpose(Image.FLIP_TOP_BOTTOM)))
+        if image.size == (1, 1):
+            return levels
+        image = image.resize((max(image.width // 2, 1), max(image.height // 2, 1)), Image.BOX)
+
+
+# Key of a build: changes whenever a source file, a target size or the build itself changes.
+def content_hash(directory=ASSETS_DIR, sprites=SPRITES, textures=TEXTURES):
+    digest = hashlib.sha256(repr((CACHE_VERSION, ATLAS_WIDTH, ATLAS_PADDING, ATLAS_ALIGN)).encode())
+    for name, (file, size) in list(sprites.items()) + list(textures.items()):
+        digest.update(repr((name, size)).encode())
+        with open(os.path.join(directory, file), 'rb') as source:
+            digest.update(source.read())
+    return digest.hexdigest()[:16]
+
+
+# The asset-build step: packs the sprites at their draw sizes into a power-of-two atlas with its
+# mipmap chain, scales the standalone textures, and saves everything as raw arrays in
+# cache_dir/<content hash>.npz, so loading it needs no image decoding. Older builds are removed.
+def build(directory=ASSETS_DIR, cache_dir=CACHE_DIR, sprites=SPRITES, textures=TEXTURES):
+    images = {name: decode(os.path.join(directory, file), size) for name, (file, size) in sprites.items()}
+    corners, height = pack([image.size for image in images.values()])
+    height = 1 << max(height - 1, 0).bit_length()  # Power-of-two height, for older GL drivers
+
+    atlas = Image.new('RGBA', (ATLAS_WIDTH, height))
+    regions = {}
+    for (name, image), (x, y) in zip(images.items(), corners):
+        atlas.paste(image, (x, y))
+        regions[name] = (x, height - y - image.height, image.width, image.height)
+
+    arrays = {f'atlas_{level}': pixels for level, pixels in enumerate(mipmaps(atlas))}
+    for name, (file, size) in textures.items():
+        arrays[f'texture_{name}'] = mipmaps(decode(os.path.join(directory, file), size))[0]
+    arrays['regions'] = np.array(json.dumps(regions))
+
+    key = content_hash(directory, sprites, textures)
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, key + '.npz')
+    partial = path + '.partial.npz'
+    np.savez(partial, **arrays)
+    os.replace(partial, path)
+    for file in os.listdir(cache_dir):
+        if file.endswith('.npz') and file != key + '.npz':
+            os.remove(os.path.join(cache_dir, file))
+    return path
+
+
+# Kivy texture from a mipmap chain (texture row order); the levels after the first are uploaded
+# as they were built instead of being generated by the driver.
+def upload(levels):
+    height, width = levels[0].shape[:2]
+    texture = Texture.create(size=(width, height), colorfmt='rgba', mipmap=len(levels) > 1)
+    for level, pixels in enumerate(levels):
+        texture.blit_buffer(pixels.tobytes(), size=(pixels.shape[1], pixels.shape[0]), colorfmt='rgba',
+                            bufferfmt='ubyte', mipmap_level=level, mipmap_generation=False)
+    if len(levels) > 1:
+        texture.min_filter = 'linear_mipmap_linear'
+    return texture
+
+
+# Every sprite of the game as one atlas texture, loaded from the asset cache (built first if the
+# sources changed since the last build). texture(id) hands out the region of a sprite, which Kivy
+# instructions accept like any texture; since all sprites share the atlas, drawing the scene keeps
+# the same texture bound instead of switching for every sprite.
+class AssetManager:
+
+    def __init__(self, directory=ASSETS_DIR, cache_dir=CACHE_DIR):
+        path = os.path.join(cache_dir, content_hash(directory) + '.npz')
+        if not os.path.exists(path):
+            path = build(directory, cache_dir)
+
+        with np.load(path) as cache:
+            levels = sorted((name for name in cache.files if name.startswith('atlas_')), key=lambda name: int(name[6:]))
+            self.atlas = upload([cache[name] for name in levels])
+            self.textures = {name: self.atlas.get_region(*region)
+                             for name, region in json.loads(str(cache['regions'])).items()}
+            for name in cache.files:
+                if name.startswith('texture_'):
+                    self.textures[name[8:]] = upload([cache[name]])
+
+    def texture(self, name):
+        return self.textures[name]
+
+
+_assets = None
+
+
+# The assets shared by every screen, loaded on first use (that needs the GL window to exist).
+def get_assets():
+    global _assets
+    if _assets is None:
+        _assets = AssetManager()
+    return _assets
+
+
+# Usage: python src/assets.py, to build the asset cache ahead of the first start.
+if __name__ == '__main__':
+    print(build())
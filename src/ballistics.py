@@ -0,0 +1,124 @@
+import math
+
+import numpy as np
+
+from constants import *
+
+
+# Closed-form projectile motion. Gravity acts on y only, x is always linear, so a shot is fully
+# described by its launch origin, launch velocity and gravity (GRAVITY for the cannon, 0 for the
+# straight-line pistol and laser). Every function broadcasts, so one call can solve many shots
+# against one box, or one shot against many boxes.
+
+# Contacts that end within this time of t_from are treated as leaving, not hitting. It keeps a
+# bullet that was placed on a face and is moving away from re-hitting that face.
+CONTACT_EPSILON = 1e-9
+
+
+def position(origin, velocity, gravity, t):
+    origin, velocity = np.asarray(origin, dtype=float), np.asarray(velocity, dtype=float)
+    t, gravity = np.asarray(t, dtype=float), np.asarray(gravity, dtype=float)
+    pos = origin + velocity * t[..., None]
+    pos[..., 1] += 0.5 * gravity * t * t
+    return pos
+
+
+# Times where a*t^2 + b*t + c > 0, as two open intervals (lo1, hi1), (lo2, hi2). An empty interval
+# has lo >= hi. When a <= 0 the set is a single interval and the second one is always empty.
+def _positive(a, b, c):
+    inf = np.inf
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Linear case (a == 0)
+        root = -c / b
+        lin_lo = np.where(b > 0, root, np.where(b < 0, -inf, np.where(c > 0, -inf, inf)))
+        lin_hi = np.where(b > 0, inf, np.where(b < 0, root, np.where(c > 0, inf, -inf)))
+
+        # Quadratic case, roots r1 <= r2 computed in the numerically stable form
+        disc = b * b - 4 * a * c
+        sq = np.sqrt(np.maximum(disc, 0))
+        q = -0.5 * (b + np.where(b >= 0, sq, -sq))
+        x1, x2 = q / a, c / q
+        x2 = np.where(q == 0, x1, x2)
+        r1, r2 = np.minimum(x1, x2), np.maximum(x1, x2)
+        real = disc > 0
+        up = a > 0
+        quad_lo1 = np.where(real, np.where(up, -inf, r1), np.where(up, -inf, inf))
+        quad_hi1 = np.where(real, np.where(up, r1, r2), np.where(up, inf, -inf))
+        quad_lo2 = np.where(real & up, r2, inf)
+        quad_hi2 = np.where(real & up, inf, -inf)
+
+    linear = a == 0
+    return (np.where(linear, lin_lo, quad_lo1), np.where(linear, lin_hi, quad_hi1),
+            np.where(linear, inf, quad_lo2), np.where(linear, -inf, quad_hi2))
+
+
+# Times where lo < p0 + v*t + g*t^2/2 < hi, as two intervals. Of the two inequalities the one whose
+# quadratic opens downward is a single interval, so the result never needs more than two pieces.
+def _inside(p0, v, g, lo, hi):
+    above = _positive(0.5 * g, v, p0 - lo)
+    below = _positive(-0.5 * g, -v, hi - p0)
+    flip = np.asarray(g) > 0
+    single = [np.where(flip, b, a) for a, b in zip(above, below)]
+    double = [np.where(flip, a, b) for a, b in zip(above, below)]
+    lo0, hi0 = single[0], single[1]
+    return ((np.maximum(lo0, double[0]), np.minimum(hi0, double[1])),
+            (np.maximum(lo0, double[2]), np.minimum(hi0, double[3])))
+
+
+# Earliest time >= t_from at which a box of size launched from origin overlaps rect (x, y, w, h),
+# with times relative to launch. Returns (t, axis): t is inf where the shot never touches rect and
+# axis is the face normal that was crossed last (0 for x, 1 for y). A shot already overlapping
+# rect at t_from reports t_from.
+def first_contact(origin, velocity, gravity, size, rect, t_from=0.0):
+    origin, velocity, size = (np.asarray(a, dtype=float) for a in (origin, velocity, size))
+    gravity = np.asarray(gravity, dtype=float)
+    rx, ry, rw, rh = (np.asarray(r, dtype=float) for r in rect)
+    x_parts = _inside(origin[..., 0], velocity[..., 0], 0.0, rx - size[..., 0], rx + rw)
+    y_parts = _inside(origin[..., 1], velocity[..., 1], gravity, ry - size[..., 1], ry + rh)
+
+    best = np.inf
+    axis = 0
+    for x_lo, x_hi in x_parts:
+        for y_lo, y_hi in y_parts:
+            start = np.maximum(np.maximum(x_lo, y_lo), t_from)
+            end = np.minimum(x_hi, y_hi)
+            valid = (start < end) & (end > t_from + CONTACT_EPSILON)
+            start = np.where(valid, start, np.inf)
+            better = start < best
+            axis = np.where(better, np.where(x_lo >= y_lo, 0, 1), axis)
+            best = np.where(better, start, best)
+    return best, axis
+
+
+# Time (relative to launch) at which a box of size launched from origin has left bounds (x, y, w, h)
+# for good, or t_from if it is already outside. The top edge only counts for straight-line shots:
+# anything under gravity comes back down. Returns inf for a shot that never leaves.
+def exit_time(origin, velocity, gravity, size, bounds, t_from=0.0):
+    origin, velocity, size = (np.asarray(a, dtype=float) for a in (origin, velocity, size))
+    gravity = np.asarray(gravity, dtype=float)
+    bx, by, bw, bh = bounds
+    top = np.where(gravity < 0, np.inf, by + bh)
+    exit = np.full(np.broadcast(origin[..., 0], gravity).shape, np.inf)
+    for parts in (_inside(origin[..., 0], velocity[..., 0], 0.0, bx - size[..., 0], bx + bw),
+                  _inside(origin[..., 1], velocity[..., 1], gravity, by - size[..., 1], top)):
+        axis_exit = np.full(exit.shape, t_from, dtype=float)
+        for lo, hi in parts:
+            axis_exit = np.where((lo <= t_from) & (t_from < hi), hi, axis_exit)
+        exit = np.minimum(exit, axis_exit)
+    return exit
+
+
+# Launch angles (degrees, low arc first) that carry a shot from the origin through the point
+# (dx, dy) away from it at the given speed. Straight-line weapons (gravity 0) have one answer,
+# the cannon has up to two; an unreachable point gives an empty list.
+def launch_angles(dx, dy, speed, gravity=GRAVITY):
+    if gravity == 0:
+        return [math.degrees(math.atan2(dy, dx))]
+    g = -gravity
+    v2 = speed * speed
+    disc = v2 * v2 - g * (g * dx * dx + 2 * dy * v2)
+    if disc < 0:
+        return []
+    root = math.sqrt(disc)
+    angles = {math.degrees(math.atan2(v2 - root, g * dx)), math.degrees(math.atan2(v2 + root, g * dx))}
+    return sorted(angles)
@@ -0,0 +1,293 @@
+import argparse
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from constants import *
+from profiler import profiler
+from simulation import MAX_ANGLE, MIN_ANGLE, World
+
+# Scripted workloads. Every frame simulates FRAME_DT of game time while the gun sweeps back and forth
+# between its limits. fire_every fires the weapon every that many frames, game_ticks ends the game
+# after that many ticks and starts the next one, perpetitos is the number of obstacles on top of
+# target, stone and mirror. impacts adds that many target, stone and mirror hit effects per frame
+# (widget only), a few hundred of them overlapping at any time.
+WORKLOADS = {
+    'idle': {},
+    'fire_cannon': {'weapon': 'cannon', 'fire_every': 2},
+    'fire_pistol': {'weapon': 'pistol', 'fire_every': 2},
+    'fire_laser': {'weapon': 'laser', 'fire_every': 2},
+    'obstacles': {'weapon': 'cannon', 'fire_every': 2, 'perpetitos': 64},
+    'restart': {'weapon': 'pistol', 'fire_every': 4, 'game_ticks': 3 * TICK_RATE},
+    'impacts': {'weapon': 'cannon', 'fire_every': 2, 'impacts': 10},
+}
+
+FRAME_DT = 1 / FPS
+FRAMES = 1800  # Frames per workload, 30 s of game time
+SEED = 1
+
+# Phases recorded by the profiler. Headless runs only have simulate and collisions.
+#   update: all of GameWidget.move_step
+#   simulate: World.advance, inside update
+#   collisions: the contact solver (in place of the old per-frame rectangle checks), inside simulate
+#   draw: GameWidget.update_canvas, inside update
+#   render: Kivy drawing the canvas and swapping buffers after the frame
+PHASE_WINDOW = 1 << 17  # Samples kept per phase, enough for every sample of a run
+
+# How much worse than the baseline a number may get before compare() reports it. Counts (bullets,
+# canvas instructions, Clock events) must not grow at all beyond their floor.
+TOLERANCE = 0.25
+PHASE_FLOOR_MS = 0.05
+MEMORY_FLOOR_KB = 64
+COUNT_FLOOR = 2
+
+
+# Direction for the gun to turn next: it sweeps between MIN_ANGLE and MAX_ANGLE.
+def sweep(angle, rotation):
+    if angle >= MAX_ANGLE:
+        return -1
+    if angle <= MIN_ANGLE:
+        return 1
+    return rotation or 1
+
+
+# Plays workloads on a bare World, without Kivy.
+class WorldDriver:
+
+    def __init__(self, perpetitos):
+        self.world = World(perpetitos=perpetitos, seed=SEED)
+
+    def start(self, weapon):
+        self.world.reset(SEED)
+        self.world.set_weapon(weapon)
+
+    def frame(self, fire):
+        world = self.world
+        world.set_rotation(sweep(world.angle, world.rotation))
+        if fire:
+            world.fire()
+        with profiler.phase('simulate'):
+            world.advance(FRAME_DT)
+
+    # A bare World shows no hit effects.
+    def impacts(self, count):
+        pass
+
+    def restart(self):
+        self.world.reset(SEED)
+
+    def counters(self):
+        return {'bullets': self.world.projectiles.count}
+
+    def close(self):
+        pass
+
+
+# Plays workloads through GameWidget: its button handlers and move_step, then the Clock events that
+# were due and the canvas drawn into the window, like one pass of the Kivy event loop. Scores and
+# replays of finished games go to a temporary directory.
+class WidgetDriver:
+
+    def __init__(self, perpetitos):
+        from kivy.clock import Clock
+        from kivy.core.window import Window
+        from kivy.uix.label import Label
+
+        import storage
+        from core import GameWidget
+        from scheduler import run_on_main_thread
+
+        self.directory = tempfile.TemporaryDirectory()
+        # Score callbacks run from the Clock, which frame() ticks by hand.
+        storage.open_store(os.path.join(self.directory.name, 'scores.db'), dispatch=run_on_main_thread)
+
+        self.clock = Clock
+        self.window = Window
+        self.widget = GameWidget(screen_manager=None, perpetitos=perpetitos, replay_dir=self.directory.name,
+                                 size=Window.size)
+        self.widget.score_label = Label()
+        self.widget.timer_label = Label()
+        self.world = self.widget.world
+        Window.add_widget(self.widget)
+
+    def start(self, weapon):
+        self.widget.start_game()
+        self.widget.set_weapon(weapon)
+
+    def frame(self, fire):
+        widget = self.widget
+        if sweep(widget.angle, widget.world.rotation) > 0:
+            widget.start_right_rotate(None)
+        else:
+            widget.start_left_rotate(None)
+        if fire:
+            widget.shoot_bullet(None)
+        widget.loop._frame(FRAME_DT)
+        self.clock.tick()
+        self.window.dispatch('on_draw')
+        self.window.dispatch('on_flip')
+
+    # Hit effects as the world would trigger them, on the obstacles themselves.
+    def impacts(self, count):
+        widget, world = self.widget, self.world
+        hits = ((widget.on_target_hit, world.target), (widget.on_stone_hit, world.stone),
+                (widget.on_mirror_hit, world.mirror))
+        for i in range(count):
+            handler, box = hits[i % len(hits)]
+            handler(box.pos)
+
+    def restart(self):
+        self.widget.restart_game(None)
+
+    def counters(self):
+        return {'bullets': self.world.projectiles.count,
+                'instructions': self.widget.renderer.instruction_count(),
+                'particles': self.widget.particles.count,
+                'clock_events': len(self.clock.get_events())}
+
+    def close(self):
+        import storage
+        self.window.unbind(on_flip=self.widget.loop._flipped)
+        self.window.remove_widget(self.widget)
+        storage.close_store()
+        self.directory.cleanup()
+
+
+# Plays frames of a workload and returns (ticks, games, seconds). With memory on, also returns the
+# traced memory (KB) at the end and its growth over the second half of the run, which stays near zero
+# unless something accumulates from frame to frame.
+def play(driver, spec, frames, memory=False):
+    driver.start(spec.get('weapon', 'cannon'))
+    end_tick = spec.get('game_ticks', math.inf)
+    driver.world.end_tick = end_tick
+    fire_every = spec.get('fire_every')
+    impacts = spec.get('impacts', 0)
+    ticks = 0
+    games = 1
+    halfway = None
+    if memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    for frame in range(frames):
+        if memory and frame == frames // 2:
+            halfway = tracemalloc.get_traced_memory()[0]
+        driver.impacts(impacts)
+        driver.frame(bool(fire_every) and frame % fire_every == 0)
+        if driver.world.over:
+            ticks += driver.world.tick
+            games += 1
+            driver.restart()
+            driver.world.end_tick = end_tick
+    seconds = time.perf_counter() - started
+    ticks += driver.world.tick
+    if not memory:
+        return ticks, games, seconds
+    current = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return ticks, games, seconds, current / 1024, (current - halfway) / 1024
+
+
+# Runs one workload twice, once timed with the profiler on and once under tracemalloc, and returns
+# its metrics.
+def benchmark(name, driver_class, frames=FRAMES, memory=True):
+    spec = WORKLOADS[name]
+    profiler.enabled = True
+    profiler.reset(PHASE_WINDOW)
+    driver = driver_class(spec.get('perpetitos', 1))
+    ticks, games, seconds = play(driver, spec, frames)
+    profiler.enabled = False
+    result = {'frames': frames, 'ticks': ticks, 'games': games, 'seconds': seconds,
+              'ticks_per_s': ticks / seconds, 'frames_per_s': frames / seconds,
+              'phases': profiler.summary(), 'counters': driver.counters()}
+    driver.close()
+
+    if memory:
+        driver = driver_class(spec.get('perpetitos', 1))
+        ticks, games, seconds, traced, growth = play(driver, spec, frames, memory=True)
+        result['memory_kb'] = traced
+        result['memory_growth_kb'] = growth
+        driver.close()
+    return result
+
+
+# Regressions of results against baseline, as readable lines; both are run() outputs.
+def compare(baseline, results, tolerance=TOLERANCE):
+    problems = []
+    for name, result in results['workloads'].items():
+        base = baseline['workloads'].get(name)
+        if base is None:
+            continue
+        if result['ticks_per_s'] < base['ticks_per_s'] * (1 - tolerance):
+            problems.append(f"{name}: {result['ticks_per_s']:.0f} ticks/s, was {base['ticks_per_s']:.0f}")
+        for phase, stats in result['phases'].items():
+            before = base['phases'].get(phase)
+            if before and stats['p95'] > max(before['p95'] * (1 + tolerance), before['p95'] + PHASE_FLOOR_MS):
+                problems.append(f"{name}: {phase} p95 {stats['p95']:.3f} ms, was {before['p95']:.3f} ms")
+        for counter, value in result['counters'].items():
+            before = base['counters'].get(counter)
+            if before is not None and value > before + COUNT_FLOOR:
+                problems.append(f"{name}: {value} {counter} at the end, was {before}")
+        if 'memory_growth_kb' in result and 'memory_growth_kb' in base:
+            before = base['memory_growth_kb']
+            if result['memory_growth_kb'] > before + max(abs(before) * tolerance, MEMORY_FLOOR_KB):
+                problems.append(f"{name}: memory grew {result['memory_growth_kb']:.0f} KB, was {before:.0f} KB")
+    return problems
+
+
+def run(names, headless=False, frames=FRAMES, memory=True):
+    driver_class = WorldDriver if headless else WidgetDriver
+    return {'mode': 'headless' if headless else 'widget', 'tick_rate': TICK_RATE,
+            'workloads': {name: benchmark(name, driver_class, frames, memory) for name in names}}
+
+
+def print_table(results):
+    print(f"{'workload':<12} {'ticks/s':>9} {'p95 ms:':>7} {'update':>7} {'simulate':>9} {'collide':>8} {'draw':>7} "
+          f"{'render':>7} {'bullets':>8} {'instr':>6} {'events':>7} {'mem +KB':>8}")
+    for name, result in results['workloads'].items():
+        phases, counters = result['phases'], result['counters']
+        p95 = lambda phase: f"{phases[phase]['p95']:.3f}" if phase in phases else '-'
+        print(f"{name:<12} {result['ticks_per_s']:>9.0f} {'':>7} {p95('update'):>7} {p95('simulate'):>9} "
+              f"{p95('collisions'):>8} {p95('draw'):>7} {p95('render'):>7} "
+              f"{counters['bullets']:>8} {counters.get('instructions', '-'):>6} "
+              f"{counters.get('clock_events', '-'):>7} {result.get('memory_growth_kb', math.nan):>8.0f}")
+
+
+# Usage: python src/bench.py [workload ...] [--headless] [--frames N] [--no-memory]
+#                            [--json results.json] [--baseline baseline.json]
+# Exits with status 1 when --baseline is given and a number regressed.
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark and soak test the game loop.')
+    parser.add_argument('workloads', nargs='*', help=f"any of {', '.join(WORKLOADS)} (default: all)")
+    parser.add_argument('--headless', action='store_true', help='run on a bare World, without Kivy')
+    parser.add_argument('--frames', type=int, default=FRAMES)
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc pass')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--baseline', help='compare against results saved with --json')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    args = parser.parse_args()
+    for name in args.workloads:
+        if name not in WORKLOADS:
+            parser.error(f"unknown workload {name}")
+
+    if not args.headless:
+        # Frames are driven by hand, the Clock must not sleep to hold a frame rate, and Kivy must not
+        # read this script's arguments.
+        os.environ.setdefault('KIVY_NO_ARGS', '1')
+        from kivy.config import Config
+        Config.set('graphics', 'maxfps', '0')
+
+    results = run(args.workloads or list(WORKLOADS), args.headless, args.frames, not args.no_memory)
+    print_table(results)
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as file:
+            problems = compare(json.load(file), results, args.tolerance)
+        for problem in problems:
+            print(f"REGRESSION {problem}")
+        sys.exit(1 if problems else 0)
@@ -0,0 +1,247 @@
+import argparse
+import os
+import secrets
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from ballistics import exit_time, first_contact
+from constants import *
+from projectiles import CANNON, PISTOL
+from replay import InputLog
+from simulation import (MAX_ANGLE, MIN_ANGLE, PROJECTILE_LIFETIMES, PROJECTILE_SIZES, WEAPONS, WORLD_BOUNDS,
+                        World)
+
+# Cannon speeds the bot considers, the values a player can type into the velocity box.
+BOT_SPEEDS = np.arange(100, 1001, 20)
+
+# Grid of the offline sweep: launch angles in degrees and cannon speeds.
+SWEEP_ANGLES = np.arange(MIN_ANGLE, MAX_ANGLE + 0.5, 1.0)
+SWEEP_SPEEDS = np.arange(50, 1001, 10)
+SWEEP_LAYOUTS = 1000
+SWEEP_CHUNK = 50  # Layouts per process pool task
+
+NO_HIT = -1  # Outcome of a shot that touches nothing
+
+
+# Bottom-left corners of the projectiles a weapon would launch at each of angles (degrees); the
+# same as World.muzzle, for many angles at once.
+def muzzles(world, weapon, angles):
+    gun = world.weapons[weapon]
+    angles = np.radians(angles)
+    return np.stack([gun.pos[0] + gun.size[0] / 2 + np.cos(angles) * gun.size[0] / 2,
+                     gun.pos[1] + gun.size[1] / 2 + np.sin(angles) * gun.size[0] / 2], axis=-1)
+
+
+# Index in world.boxes of what each shot of weapon at angles (and speeds, for the cannon) touches
+# first, or NO_HIT, and when (seconds after the launch). One batched solve for every shot, with the
+# World's own rules: the first contact decides, obstacles block, and shots expire when they leave the
+# field or outlive their weapon.
+def outcomes(world, weapon, angles, speeds=None):
+    if weapon == "laser":
+        return laser_outcomes(world, angles)
+    angles = np.asarray(angles, dtype=float)
+    speed, gravity = world.ballistics(weapon, None)
+    speeds = np.asarray(speeds if weapon == "cannon" else np.full(angles.shape, speed), dtype=float)
+    gravity = np.full(angles.shape, float(gravity))
+    origin = muzzles(world, weapon, angles)
+    rad = np.radians(angles)
+    velocity = np.stack([speeds * np.cos(rad), speeds * np.sin(rad)], axis=-1)
+    size = np.array(PROJECTILE_SIZES[weapon], dtype=float)
+
+    rects = np.array([box.rect() for box in world.boxes], dtype=float)
+    t, axis = first_contact(origin[:, None, :], velocity[:, None, :], gravity[:, None], size, rects.T[:, None, :])
+    box = np.argmin(t, axis=1)
+    first = t[np.arange(len(box)), box]
+    lifetime = PROJECTILE_LIFETIMES[CANNON if weapon == "cannon" else PISTOL]
+    expire = np.minimum(exit_time(origin, velocity, gravity, size, WORLD_BOUNDS), lifetime)
+    hit = first < expire
+    return np.where(hit, box, NO_HIT), np.where(hit, first, np.inf)
+
+
+# The laser counterpart of outcomes(): every beam is cast at once and followed off the mirror for up to
+# LASER_BOUNCES reflections. The beam is hitscan, so every time is zero.
+def laser_outcomes(world, angles):
+    angles = np.asarray(angles, dtype=float)
+    rad = np.radians(angles)
+    origin = muzzles(world, "laser", angles)
+    direction = np.stack([np.cos(rad), np.sin(rad)], axis=-1)
+    remaining = np.full(angles.shape, float(LASER_DIST))
+    result = np.full(angles.shape, NO_HIT)
+    active = np.ones(angles.shape, dtype=bool)
+    rects = np.array([box.rect() for box in world.boxes], dtype=float)
+    mirror = world.boxes.index(world.mirror)
+
+    for bounce in range(LASER_BOUNCES + 1):
+        rows = np.flatnonzero(active)
+        if not len(rows):
+            break
+        dist, axis = first_contact(origin[rows, None, :], direction[rows, None, :], 0.0, (0, 0), rects.T[:, None, :])
+        box = np.argmin(dist, axis=1)
+        first = dist[np.arange(len(rows)), box]
+        reached = first <= remaining[rows]
+        reflected = reached & (box == mirror)
+        stopped = reached & ~reflected
+        result[rows[stopped]] = box[stopped]
+        active[rows[~reflected]] = False
+
+        rows, first, axis = rows[reflected], first[reflected], axis[np.arange(len(box)), box][reflected]
+        origin[rows] += direction[rows] * first[:, None]
+        direction[rows, axis] = -direction[rows, axis]
+        remaining[rows] -= first
+    return result, np.where(result != NO_HIT, 0.0, np.inf)
+
+
+# Plays the game through the World's controls, as World.script: before each tick it either turns the
+# gun one tick toward its planned shot, or fires it. Plans are made while no projectile is in flight,
+# so nothing can move the target in between. Every decision scores all reachable (weapon, angle,
+# speed) shots in one batch: the angles are exactly those the gun reaches after whole ticks of
+# rotation, and the fastest hit (turning plus flight time) wins. When nothing can hit the target, the
+# bot shoots an obstacle that a hit moves away (the stone with the cannon, the mirror with cannon or
+# pistol), or waits.
+class Bot:
+
+    def __init__(self, speeds=BOT_SPEEDS):
+        self.speeds = np.asarray(speeds)
+        self.plan = None  # (weapon, angle, speed, ticks of turning)
+        self.evaluated = 0  # Candidate shots scored so far
+
+    # Every angle the gun reaches by turning one way for whole ticks, with the number of ticks. The
+    # angles are stepped exactly like World.step does, so a planned angle is reached exactly.
+    def reachable(self, world):
+        step = ROTATE_SPEED * world.tick_dt
+        angles, ticks = [world.angle], [0]
+        for direction, limit in ((-1, MIN_ANGLE), (1, MAX_ANGLE)):
+            angle, tick = world.angle, 0
+            while angle != limit:
+                angle = min(max(angle + direction * step, MIN_ANGLE), MAX_ANGLE)
+                tick += 1
+                angles.append(angle)
+                ticks.append(tick)
+        return np.array(angles), np.array(ticks)
+
+    def decide(self, world):
+        angles, ticks = self.reachable(world)
+        wanted = {"cannon": (world.target, world.stone, world.mirror), "pistol": (world.target, world.mirror),
+                  "laser": (world.target,)}
+        best = None
+        for weapon in WEAPONS:
+            if weapon == "cannon":
+                shot_angles = np.repeat(angles, len(self.speeds))
+                shot_ticks = np.repeat(ticks, len(self.speeds))
+                speeds = np.tile(self.speeds, len(angles))
+            else:
+                shot_angles, shot_ticks, speeds = angles, ticks, np.full(len(angles), world.bullet_speed)
+            box, t = outcomes(world, weapon, shot_angles, speeds)
+            self.evaluated += len(box)
+            for obstacle in wanted[weapon]:
+                penalty = 0.0 if obstacle is world.target else 1e6  # Any target hit goes first
+                cost = np.where(box == world.boxes.index(obstacle), shot_ticks * world.tick_dt + t + penalty, np.inf)
+                k = int(np.argmin(cost))
+                if np.isfinite(cost[k]) and (best is None or cost[k] < best[0]):
+                    best = (cost[k], weapon, float(shot_angles[k]), int(speeds[k]), int(shot_ticks[k]))
+        self.plan = best[1:] if best else None
+
+    def feed(self, world):
+        if self.plan is None:
+            if world.projectiles.count:
+                world.set_rotation(0)
+                return
+            self.decide(world)
+            if self.plan is None:
+                world.set_rotation(0)
+                return
+        weapon, angle, speed, ticks = self.plan
+        if world.angle == angle:
+            world.set_rotation(0)
+            world.set_weapon(weapon)
+            world.set_speed(speed)
+            world.fire()
+            self.plan = None
+        else:
+            world.set_rotation(1 if angle > world.angle else -1)
+
+
+# Plays one headless game with the bot and returns the World and its replay.
+def play(seed=None, game_time=GAME_TIME):
+    world = World()
+    world.reset(secrets.randbits(63) if seed is None else seed)
+    world.end_tick = game_time * TICK_RATE
+    log = InputLog(world.seed, end_tick=world.end_tick)
+    world.recorder = log
+    bot = world.script = Bot()
+    while not world.over:
+        world.run_tick()
+    return world, log, bot
+
+
+# Target hit counts over the sweep grid for the layouts of seeds: obstacles are placed by the seeded
+# random_position, as after respawns. Returns {weapon: counts}; counts are (angles, speeds) for the
+# cannon and (angles,) for the straight-line weapons.
+def sweep_layouts(seeds):
+    world = World()
+    counts = {"cannon": np.zeros((len(SWEEP_ANGLES), len(SWEEP_SPEEDS)), dtype=np.int64),
+              "pistol": np.zeros(len(SWEEP_ANGLES), dtype=np.int64),
+              "laser": np.zeros(len(SWEEP_ANGLES), dtype=np.int64)}
+    angles = np.repeat(SWEEP_ANGLES, len(SWEEP_SPEEDS))
+    speeds = np.tile(SWEEP_SPEEDS, len(SWEEP_ANGLES))
+    target = world.boxes.index(world.target)
+    for seed in seeds:
+        world.reset(seed)
+        world.respawn_target()
+        world.respawn_stone()
+        world.respawn_mirror()
+        box, t = outcomes(world, "cannon", angles, speeds)
+        counts["cannon"] += (box == target).reshape(counts["cannon"].shape)
+        for weapon in ("pistol", "laser"):
+            box, t = outcomes(world, weapon, SWEEP_ANGLES)
+            counts[weapon] += box == target
+    return counts
+
+
+# Hit probability of every grid shot over layouts random layouts, computed on a process pool (one
+# worker per core by default) and written to path as a NumPy .npz archive: angles, speeds and one
+# probability map per weapon.
+def sweep(path, layouts=SWEEP_LAYOUTS, workers=None, seed=0):
+    chunks = [range(start, min(start + SWEEP_CHUNK, layouts)) for start in range(0, layouts, SWEEP_CHUNK)]
+    chunks = [[seed * layouts + i for i in chunk] for chunk in chunks]
+    totals = None
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        for counts in pool.map(sweep_layouts, chunks):
+            totals = counts if totals is None else {weapon: totals[weapon] + counts[weapon] for weapon in totals}
+    maps = {weapon: count / layouts for weapon, count in totals.items()}
+    np.savez_compressed(path, angles=SWEEP_ANGLES, speeds=SWEEP_SPEEDS, layouts=layouts, **maps)
+    return maps
+
+
+# Usage: python src/bot.py play [--games N] [--save]
+#        python src/bot.py sweep [--layouts N] [--workers N] [--out sweep.npz]
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Auto-aim bot and hit-probability sweep.')
+    parser.add_argument('mode', choices=('play', 'sweep'))
+    parser.add_argument('--games', type=int, default=1)
+    parser.add_argument('--save', action='store_true', help='save the games as replays')
+    parser.add_argument('--layouts', type=int, default=SWEEP_LAYOUTS)
+    parser.add_argument('--workers', type=int, help='sweep processes (default: one per core)')
+    parser.add_argument('--out', default='sweep.npz')
+    args = parser.parse_args()
+
+    if args.mode == 'play':
+        for game in range(args.games):
+            started = time.perf_counter()
+            world, log, bot = play()
+            took = time.perf_counter() - started
+            accuracy = world.hits / world.shots if world.shots else 0
+            print(f'Score: {world.score}, Shots: {world.shots}, Accuracy: {accuracy:.2f}, '
+                  f'{bot.evaluated} shots evaluated, {world.tick / took:.0f} ticks/s')
+            if args.save:
+                print(f'Replay: {log.id} ({log.save()})')
+    else:
+        started = time.perf_counter()
+        maps = sweep(args.out, args.layouts, args.workers)
+        print(f'{args.layouts} layouts in {time.perf_counter() - started:.1f}s, written to {args.out}')
+        for weapon, probability in maps.items():
+            best = np.unravel_index(np.argmax(probability), probability.shape)
+            shot = f'angle {SWEEP_ANGLES[best[0]]:.0f}' + (f', speed {SWEEP_SPEEDS[best[1]]}' if probability.ndim == 2 else '')
+            print(f'{weapon}: mean hit probability {probability.mean():.3f}, best {probability.max():.3f} at {shot}')
@@ -15,6 +15,7 @@ BOMB_RADIUS = 10  # Radius of a bomb, likely used for collision detection and re
 LASER_DIST = 500  # Maximum distance a laser can travel
 LASER_IMPULSE = 100  # Impulse applied when a laser is fired, affecting its initial speed
 LASER_VEL = 600  # Velocity of the laser, determining how fast it travels
+LASER_BOUNCES = 4  # Maximum number of mirror reflections of one laser beam
 
 # Bomb drilling property
 BOMB_DRILL = 50  # Drill power of the bomb, potentially indicating how much damage or penetration it can cause
@@ -25,4 +26,14 @@ GRAVITY = -100  # Gravity constant, affecting the acceleration of falling object
 # Game timing
 GAME_TIME = 60  # Total game time in seconds, which might be the duration of a level or a match
 
-PISTOL_BULL = 400
\ No newline at end of file
+PISTOL_BULL = 400
+
+# Projectile lifetime caps in seconds; a shot is also dropped as soon as it leaves the screen for good
+CANNON_LIFETIME = 10
+PISTOL_LIFETIME = 5
+
+ROTATE_SPEED = 100  # Weapon rotation speed in degrees per second while a rotate button is held
+
+# Simulation timing, independent of the render rate
+TICK_RATE = 60  # Fixed simulation ticks per second; can be lowered (e.g. 30) on weak machines or headless runs
+MAX_TICKS_PER_FRAME = 8  # Upper bound of ticks run for one rendered frame, so a long stall cannot snowball
@@ -1,11 +1,6 @@
-import math
-import random
-import sqlite3
-from datetime import datetime
+import secrets
 
 # Kivy components
-from kivy.clock import Clock
-from kivy.graphics import Rectangle, PopMatrix, PushMatrix, Rotate
 from kivy.uix.button import Button
 from kivy.uix.floatlayout import FloatLayout
 from kivy.uix.label import Label
@@ -13,293 +8,263 @@ from kivy.uix.popup import Popup
 from kivy.uix.widget import Widget
 
 from constants import *
-
-
-# Function to check collision between two rectangles defined by their positions and sizes.
-def collides(rect1, rect2):
-    r1x, r1y, r1w, r1h = rect1
-    r2x, r2y, r2w, r2h = rect2
-    return r1x < r2x + r2w and r1x + r1w > r2x and r1y < r2y + r2h and r1y + r1h > r2y
-
+from leaderboard import current_leaderboard
+from particles import ParticleSystem
+from profiler import profiler
+from renderer import SceneRenderer
+from replay import InputLog, start as start_replay
+from scheduler import GameLoop, InputState, run_on_main_thread
+from simulation import SPEED, WEAPON, WEAPONS, World
+from storage import get_writer
+from telemetry import shot_rows
 
 
 class GameWidget(Widget):
 
-    def __init__(self, screen_manager, **kwargs):
+    def __init__(self, screen_manager, perpetitos=1, replay_dir=None, **kwargs):
         super().__init__(**kwargs)
         self.screen_manager = screen_manager
-
-        # Initialize game state variables
-        self.angle = 0
-        self.min_angle = -45
-        self.max_angle = 80
-        self.bullets = []
-        self.score = 0
-        self.shots = 0
-        self.hits = 0
-        self.explosion = None
-        self.explosion_duration = 0.5
-        self.weapon = "cannon"
+        self.replay_dir = replay_dir  # Where replays of finished games go, REPLAY_DIR by default
+
+        # All physics, collision and scoring rules live in the headless World, this widget only draws it.
+        self.world = World(on_target_hit=self.on_target_hit,
+                           on_stone_hit=self.on_stone_hit,
+                           on_mirror_hit=self.on_mirror_hit,
+                           perpetitos=perpetitos,
+                           on_fire=self.on_shot)
+
+        # Initialize game state variables. The gun (angle, weapon, speed) is part of the world too,
+        # so that every change to it is recorded for the replay.
+        self.beam = None
+        self.beam_duration = 0.15  # Seconds of game time a laser beam stays visible
         self.time_left = GAME_TIME
         self.game_over = False
-        self.timer_event = None
-        self.bullet_speed = 300
-   
-        # Loads game assets (Rectangle objects with image sources) onto the canvas.
-        with self.canvas:
-            self.background = Rectangle(source="assets/bg.jpg", pos=self.pos, size=self.size)
-            self.cannon = Rectangle(source="assets/cannon.png", pos=(10, 40), size=(150, 67))
-            self.table = Rectangle(source="assets/cannon2.png", pos=(10, 0), size=(86, 68))
-            self.pistol = Rectangle(source="assets/pistol.png", pos=(10, 40), size=(150, 50))
-            self.laser_gun = Rectangle(source="assets/laser_gun.png", pos=(10, 40), size=(150, 50))
-            self.target = Rectangle(source="assets/enemy.png", pos=(800, 300), size=(100, 100))
-            self.stone = Rectangle(source="assets/stone.png", pos=(600, 200), size=(100, 100))
-            self.mirror = Rectangle(source="assets/mirror.png", pos=(400, 250), size=(100, 100))
-            self.perpetitos = [Rectangle(source="assets/perpetito.webp", pos=self.random_position(), size=(100, 100))
-                               for _ in range(1)]
+        self.game_id = None
+        self.contact_tests = 0
+        self.replay_log = None  # Inputs of the game being played
+        self.replaying = False  # Watching a replay: no input is taken and nothing is saved
+        self.replay_speed = 1.0
+
+        # Builds the retained scene once; frames only update the instructions it owns.
+        self.canvas.clear()
+        # Impact effects are particles: any number can overlap, and none needs a Clock event.
+        self.particles = ParticleSystem()
+        self.renderer = SceneRenderer(self.canvas, self.world, self.particles)
 
         # Sets up event bindings (bind) for resizing and repositioning the background.
         self.bind(size=self.update_background, pos=self.update_background)
+        self.update_background()
+
+        # One tick per frame drives rotation, the timer, the world and drawing; the game screen
+        # starts and stops it on enter/leave.
+        self.input = InputState()
+        self.loop = GameLoop(self.move_step)
+
+    # Score counters are owned by the world so headless runs and the UI agree.
+    @property
+    def score(self):
+        return self.world.score
+
+    @score.setter
+    def score(self, value):
+        self.world.score = value
+
+    @property
+    def shots(self):
+        return self.world.shots
 
-        self.bullet_speed = 300
-        self.left_rotate_event = None
-        self.right_rotate_event = None
+    @shots.setter
+    def shots(self, value):
+        self.world.shots = value
 
-        # Schedules move_step function to be called at a specific interval.
-        Clock.schedule_interval(self.move_step, 1 / FPS)
+    @property
+    def hits(self):
+        return self.world.hits
+
+    @hits.setter
+    def hits(self, value):
+        self.world.hits = value
+
+    @property
+    def angle(self):
+        return self.world.angle
+
+    @property
+    def weapon(self):
+        return self.world.weapon
+
+    @property
+    def bullet_speed(self):
+        return self.world.bullet_speed
 
     # Generate a random position within screen boundaries
     def random_position(self):
-        return (random.randint(200, SCREEN_WIDTH - 200), random.randint(200, SCREEN_HEIGHT - 200))
+        return self.world.random_position()
 
-    # Methods to handle rotation of a cannon or other objects.
+    # Methods to handle rotation of a cannon or other objects. The buttons only record what is held,
+    # move_step hands it to the world, which turns the gun tick by tick.
 
     def start_left_rotate(self, instance):
-        self.stop_right_rotate(instance)
-        self.left_rotate_event = Clock.schedule_interval(self.rotate_left, 0.01)
+        self.input.rotate_right = False
+        self.input.rotate_left = True
 
     def stop_left_rotate(self, instance):
-        if self.left_rotate_event:
-            self.left_rotate_event.cancel()
-            self.left_rotate_event = None
+        self.input.rotate_left = False
 
     def start_right_rotate(self, instance):
-        self.stop_left_rotate(instance)
-        self.right_rotate_event = Clock.schedule_interval(self.rotate_right, 0.01)
+        self.input.rotate_left = False
+        self.input.rotate_right = True
 
     def stop_right_rotate(self, instance):
-        if self.right_rotate_event:
-            self.right_rotate_event.cancel()
-            self.right_rotate_event = None
+        self.input.rotate_right = False
 
-    # Methods to adjust the angle of rotation (angle) incrementally.
+    # Passes the held direction to the world, which keeps the angle within MIN_ANGLE..MAX_ANGLE.
+    def rotate(self):
+        self.world.set_rotation(self.input.rotation())
 
-    def rotate_left(self, dt):
-        self.angle = max(self.angle - 1, self.min_angle)
-        self.update_canvas()
-
-    def rotate_right(self, dt):
-        self.angle = min(self.angle + 1, self.max_angle)
-        self.update_canvas()
-
-    # Bullet Shooting, Depending on the current weapon selected (cannon, pistol, laser), shoots bullets (Rectangle objects) with specified velocities and positions.
+    # Bullet Shooting, Depending on the current weapon selected (cannon, pistol, laser), the world fires a projectile
+    # with the matching velocity, or casts the laser beam and resolves its hits at once.
     def shoot_bullet(self, instance):
-        if self.game_over:
+        if self.game_over or self.replaying:
             return
-
-        self.shots += 1
-        angle_rad = math.radians(self.angle)
-        bullet_velocity = (self.bullet_speed * math.cos(angle_rad),
-                           self.bullet_speed * math.sin(angle_rad))
-        if self.weapon == "cannon":
-            bullet_start_x = self.cannon.pos[0] + self.cannon.size[0] / 2 + math.cos(angle_rad) * self.cannon.size[
-                0] / 2
-            bullet_start_y = self.cannon.pos[1] + self.cannon.size[1] / 2 + math.sin(angle_rad) * self.cannon.size[
-                0] / 2
-            bullet = {
-                'rect': Rectangle(source="assets/ball.png", pos=(bullet_start_x, bullet_start_y), size=(35, 35)),
-                'velocity': bullet_velocity,
-                'type': 'cannon'
-            }
-        elif self.weapon == "pistol":
-            bullet_start_x = self.pistol.pos[0] + self.pistol.size[0] / 2 + math.cos(angle_rad) * self.pistol.size[
-                0] / 2
-            bullet_start_y = self.pistol.pos[1] + self.pistol.size[1] / 2 + math.sin(angle_rad) * self.pistol.size[
-                0] / 2
-            bullet = {
-                'rect': Rectangle(source="assets/bullet.png", pos=(bullet_start_x, bullet_start_y), size=(30, 20)),
-                'velocity': (PISTOL_BULL * math.cos(angle_rad), PISTOL_BULL * math.sin(angle_rad)),
-                'angle': self.angle,
-                'type': 'pistol'
-            }
-        elif self.weapon == "laser":
-            bullet_start_x = self.laser_gun.pos[0] + self.laser_gun.size[0] / 2 + math.cos(angle_rad) * self.laser_gun.size[0] / 2
-            bullet_start_y = self.laser_gun.pos[1] + self.laser_gun.size[1] / 2 + math.sin(angle_rad) * self.laser_gun.size[0] / 2
-            bullet = {
-                'rect': Rectangle(source="assets/sticker.webp", pos=(bullet_start_x, bullet_start_y),
-                                  size=(30, 20)),
-                'velocity': (LASER_VEL * math.cos(angle_rad), LASER_VEL * math.sin(angle_rad)),
-                'angle': self.angle,
-                'type': 'laser'
-            }
-        
-        self.bullets.append(bullet)
+        self.world.fire()
+
+    # Shows a shot fired by the player or by a replay.
+    def on_shot(self, shot):
+        if self.weapon == "laser":
+            # The laser is hitscan, its beam is only shown briefly; move_step hides it once it expires.
+            # A new shot replaces the beam along with its expiry.
+            self.beam = {'points': shot.points, 'until': self.world.time + self.beam_duration}
         self.update_labels()  # Update the labels each time a bullet is shot
 
-    
 
-# Collision Handling method: Updates the position of bullets, checks for collisions 
-# with various game objects (target, stone, mirror, perpetitos), and 
-# triggers appropriate actions (on_target_hit, on_stone_hit, on_mirror_hit).
+# Game loop tick, called once per frame by self.loop: applies held rotation and advances the world by the
+# frame time in fixed ticks (TICK_RATE), which turn the gun, move the bullets, check for collisions with
+# various game objects (target, stone, mirror, perpetitos), and trigger appropriate actions (on_target_hit,
+# on_stone_hit, on_mirror_hit). The timer counts the world's ticks down to GAME_TIME. Then moves the particles by
+# the same time, hides an expired laser beam and draws the frame. A replay is advanced by replay_speed times the
+# frame time.
     def move_step(self, dt):
         if self.game_over:
             return
 
-        new_bullets = []
-        for bullet in self.bullets:
-            if bullet['type'] == "cannon":
-                bullet['velocity'] = (bullet['velocity'][0], bullet['velocity'][1] + GRAVITY * dt)
-            bullet['rect'].pos = (bullet['rect'].pos[0] + bullet['velocity'][0] * dt,
-                                  bullet['rect'].pos[1] + bullet['velocity'][1] * dt)
-            bullet_rect = bullet['rect'].pos + bullet['rect'].size
-            if collides(bullet_rect, self.target.pos + self.target.size):
-                self.on_target_hit(bullet['rect'].pos)
-            elif collides(bullet_rect, self.stone.pos + self.stone.size):
-                if bullet['type'] == "cannon":
-                    self.on_stone_hit(bullet['rect'].pos)
-                elif bullet['type'] == "pistol":
-                    bullet['type'] = "pistol_hit_stone"
-                    new_bullets.append(bullet)
-            elif collides(bullet_rect, self.mirror.pos + self.mirror.size):
-                if bullet['type'] == "laser":
-                    bullet['velocity'] = (-bullet['velocity'][0], bullet['velocity'][1])
-                    new_bullets.append(bullet)
-                else:
-                    self.on_mirror_hit(bullet['rect'].pos)
-            elif any(collides(bullet_rect, perpetito.pos + perpetito.size) for perpetito in self.perpetitos):
-                continue
-            else:
-                new_bullets.append(bullet)
-
-        self.bullets = new_bullets
-        self.update_canvas()
-
-
-# Event Handlers (on_target_hit, on_stone_hit, on_mirror_hit), Methods that handle events when bullets collide with specific game objects (target, stone, mirror). 
-# They update game state variables (score, hits), trigger visual effects (explosion), and respawn objects.
+        if self.replaying:
+            dt *= self.replay_speed
+        else:
+            self.rotate()
+        with profiler.phase('simulate'):
+            self.world.advance(dt)
+        if GAME_TIME - int(self.world.time) != self.time_left or self.world.over:
+            self.update_time()
+            if self.game_over:
+                return
+        with profiler.phase('draw'):
+            self.particles.update(dt)
+            if self.beam and self.world.time >= self.beam['until']:
+                self.beam = None
+            self.update_canvas()
+        if profiler.enabled:
+            self.count_frame()
+
+    # Per-frame counters for the profiler: bullets in flight, shot/obstacle pairs solved since the
+    # last frame and canvas instructions in the scene.
+    def count_frame(self):
+        profiler.count('bullets', self.world.projectiles.count)
+        profiler.count('contacts', self.world.contact_tests - self.contact_tests)
+        profiler.count('instructions', self.renderer.instruction_count())
+        profiler.count('particles', self.particles.count)
+        self.contact_tests = self.world.contact_tests
+
+
+# Event Handlers (on_target_hit, on_stone_hit, on_mirror_hit), Called by the world after it has updated the score
+# and respawned the object that was hit. They update the labels and start the impact's particle burst.
     def on_target_hit(self, pos):
-        self.score += 1
-        self.hits += 1
         self.update_labels()
-        self.explosion = {'pos': pos, 'time': Clock.get_time()}
-        Clock.schedule_once(self.clear_explosion, self.explosion_duration)
-        self.respawn_target()
+        self.particles.burst("target", pos)
 
     def on_stone_hit(self, pos):
-        self.explosion = {'pos': pos, 'time': Clock.get_time()}
-        Clock.schedule_once(self.clear_explosion, self.explosion_duration)
-        self.respawn_stone()
+        self.particles.burst("stone", pos)
 
     def on_mirror_hit(self, pos):
-        self.explosion = {'pos': pos, 'time': Clock.get_time()}
-        Clock.schedule_once(self.clear_explosion, self.explosion_duration)
-        self.respawn_mirror()
-
-    def clear_explosion(self, dt):
-        self.explosion = None
+        self.particles.burst("mirror", pos)
 
     def respawn_target(self):
-        self.target.pos = self.random_position()
+        self.world.respawn_target()
 
     def respawn_stone(self):
-        self.stone.pos = self.random_position()
+        self.world.respawn_stone()
 
     def respawn_mirror(self):
-        self.mirror.pos = self.random_position()
+        self.world.respawn_mirror()
 
     def respawn_perpetitos(self):
-        for perpetito in self.perpetitos:
-            perpetito.pos = self.random_position()
+        self.world.respawn_perpetitos()
 
-# Clears and redraws the game canvas with updated positions of game objects, bullets, and visual effects.
+# Pushes the current positions, rotation, weapon, particles and laser beam into the retained scene.
     def update_canvas(self):
-        self.canvas.clear()
-        with self.canvas:
-            self.background = Rectangle(source="assets/bg.jpg", pos=self.pos, size=self.size)
-            if self.weapon == "cannon":
-                self.canvas.add(self.table)
-            self.target = Rectangle(source="assets/enemy.png", pos=self.target.pos, size=self.target.size)
-            self.stone = Rectangle(source="assets/stone.png", pos=self.stone.pos, size=self.stone.size)
-            self.mirror = Rectangle(source="assets/mirror.png", pos=self.mirror.pos, size=self.mirror.size)
-            for perpetito in self.perpetitos:
-                self.canvas.add(perpetito)
-            for bullet in self.bullets:
-                with self.canvas.before:
-                    PushMatrix()
-                    Rotate(angle=bullet.get('angle', 0), origin=(bullet['rect'].pos[0], bullet['rect'].pos[1]))
-                    self.canvas.add(bullet['rect'])
-                    PopMatrix()
-            if self.explosion:
-                self.canvas.add(Rectangle(source="assets/explosion.png", pos=self.explosion['pos'], size=(100, 100)))
-            PushMatrix()
-            Rotate(angle=self.angle,
-                   origin=(self.cannon.pos[0] + self.cannon.size[0] / 2, self.cannon.pos[1] + self.cannon.size[1] / 2))
-            if self.weapon == "cannon":
-                self.canvas.add(self.cannon)
-            elif self.weapon == "pistol":
-                self.canvas.add(self.pistol)
-            elif self.weapon == "laser":
-                self.canvas.add(self.laser_gun)
-            PopMatrix()
+        self.renderer.draw(self.angle, self.weapon, self.beam)
 
 # Adjusts the size and position of the background based on window size changes.
     def update_background(self, *args):
-        self.background.size = self.size
-        self.background.pos = self.pos
+        self.renderer.set_background(self.pos, self.size)
 
 
 # Weapon Selection (set_weapon), Changes the current weapon (cannon, pistol, laser) and updates bullet speed accordingly.
     def set_weapon(self, weapon):
-        self.weapon = weapon
+        if self.replaying:
+            return
+        self.world.set_weapon(weapon)
         self.update_canvas()
-     
+
     def set_custom_velocity(self, velocity):
+        if self.replaying:
+            return
         try:
-            self.bullet_speed = int(velocity)
+            self.world.set_speed(int(velocity))
         except ValueError:
-            self.bullet_speed = 300  # Default value if input is invalid
+            self.world.set_speed(300)  # Default value if input is invalid
         self.update_canvas()
 
 
 # Game Flow 
 
 # Updates the game timer and handles game-over conditions.
-    def update_time(self, dt):
-        if self.game_over:
-            return
-
-        self.time_left -= 1
+    def update_time(self):
+        self.time_left = max(GAME_TIME - int(self.world.time), 0)
         self.timer_label.text = f"Time: {self.time_left}s"
 
-        if self.time_left <= 0:
+        if self.world.over:
             self.game_over = True
-            self.save_score()
+            if self.replaying:
+                self.timer_label.text = "Replay over"
+                self.show_game_over()
+            else:
+                self.save_score()
 
-# Saves the player's score, shots, hits, and accuracy in a database.
+# Saves the player's score, shots, hits, and accuracy, with the game's per-shot log and its replay. The
+# writes are queued for the background writer, so showing the game-over popup never waits on the disk.
     def save_score(self):
-        accuracy = self.hits / self.shots if self.shots > 0 else 0
-        conn = sqlite3.connect('scores.db')
-        cursor = conn.cursor()
-        cursor.execute('''CREATE TABLE IF NOT EXISTS scores
-                          (id INTEGER PRIMARY KEY, score INTEGER, date TEXT, shots INTEGER, hits INTEGER, accuracy REAL)''')
-        current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        cursor.execute('INSERT INTO scores (score, date, shots, hits, accuracy) VALUES (?, ?, ?, ?, ?)',
-                       (self.score, current_time, self.shots, self.hits, accuracy))
-        conn.commit()
-        conn.close()
+        shot_log = self.world.shot_log.columns()  # Copied now, the next game clears the log
+        writer = get_writer(dispatch=run_on_main_thread)
+        replay_log = self.replay_log
+        replay_dir = self.replay_dir
+        writer.submit(lambda store: replay_log.save(replay_dir))
+        writer.save_score(self.score, self.shots, self.hits, callback=self.on_score_saved, shot_rows=shot_rows(shot_log),
+                          replay_id=replay_log.id)
         self.timer_label.text = "Game Over!"
         self.show_game_over()
 
+# Called on the main thread once the score is on disk, with its stored row (None if the write failed).
+# The row also goes straight into the cached leaderboard, if the high-score screen has built one.
+    def on_score_saved(self, row):
+        if row is None:
+            self.timer_label.text = "Game Over! (score not saved)"
+            return
+        self.game_id = row[0]
+        leaderboard = current_leaderboard()
+        if leaderboard is not None:
+            leaderboard.add(row)
+
 # Displays a popup with game-over message and options to restart or return to the menu.
     def show_game_over(self):
         content = FloatLayout()
@@ -320,32 +285,47 @@ class GameWidget(Widget):
 
 # Methods to restart the game or return to the main menu.
     def restart_game(self, instance):
-        self.stop_game()  # Stop the previous timer before restarting
         self.popup.dismiss()
-        self.clear_widgets()
-        self.__init__(self.screen_manager)
         self.start_game()
 
     def return_to_menu(self, instance):
-        self.stop_game()  # Stop the timer when returning to the menu
+        self.stop_game()
         self.popup.dismiss()
         self.screen_manager.current = 'menu'
 
-# Methods to start and stop the game loop and timer.
+# Methods to start and pause the game. The loop itself is owned by the game screen. Every game gets a fresh
+# seed and records its inputs, starting with the weapon and speed it begins with.
     def start_game(self):
+        self.world.reset(secrets.randbits(63))
+        self.replay_log = InputLog(self.world.seed)
+        self.replay_log(0, WEAPON, WEAPONS.index(self.weapon))
+        self.replay_log(0, SPEED, self.bullet_speed)
+        self.world.recorder = self.replay_log
+        self.replaying = False
+        self.reset_view()
+
+# Watches a recorded game (replay.InputLog) at speed times real time. It is not saved again.
+    def start_replay(self, log, speed=1.0):
+        self.world.recorder = None
+        start_replay(self.world, log)
+        self.replay_log = log
+        self.replaying = True
+        self.replay_speed = speed
+        self.reset_view()
+
+    def reset_view(self):
         self.game_over = False
         self.time_left = GAME_TIME
-        self.score = 0
-        self.shots = 0
-        self.hits = 0
+        self.input.clear()
+        self.particles.clear()
+        self.beam = None
         self.update_labels()
-        self.timer_event = Clock.schedule_interval(self.update_time, 1)
+        self.timer_label.text = f"Time: {self.time_left}s"
         self.update_canvas()
 
     def stop_game(self):
-        if self.timer_event:
-            self.timer_event.cancel()
-            self.timer_event = None
+        self.loop.stop()
+        self.input.clear()
 
     def update_labels(self):
         self.score_label.text = f"Score: {self.score} | Shots: {self.shots}"
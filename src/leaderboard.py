@@ -0,0 +1,57 @@
+from storage import get_store
+
+LEADERBOARD_SIZE = 10  # Rows kept in memory for the top of the high-score screen
+PAGE_SIZE = 50  # Rows fetched per page when scrolling further down
+
+
+# Leaderboard order key of an (id, score, date, shots, hits, accuracy) row; higher ranks first.
+def rank_key(row):
+    return row[5], row[1], row[0]
+
+
+# The top of the leaderboard, cached in memory and kept current as games are saved, so the
+# high-score screen only reads the database for rows below it. The cache is loaded on first use;
+# add() inserts a newly saved row in place instead of re-running the query, unless the load already
+# read it from the database.
+class Leaderboard:
+
+    def __init__(self, store, size=LEADERBOARD_SIZE):
+        self.store = store
+        self.size = size
+        self.rows = None
+
+    def top(self):
+        if self.rows is None:
+            self.rows = self.store.top_scores(self.size)
+        return self.rows
+
+    def add(self, row):
+        if self.rows is None or any(cached[0] == row[0] for cached in self.rows):
+            return
+        key = rank_key(row)
+        i = 0
+        while i < len(self.rows) and rank_key(self.rows[i]) > key:
+            i += 1
+        if i < self.size:
+            self.rows.insert(i, row)
+            del self.rows[self.size:]
+
+    # The rows ranked below row (the last one already shown), or the first page when row is None.
+    def page(self, row=None, limit=PAGE_SIZE):
+        return self.store.scores_page(None if row is None else rank_key(row), limit)
+
+
+_leaderboard = None
+
+
+# The leaderboard shared by the game and the high-score screen.
+def get_leaderboard():
+    global _leaderboard
+    if _leaderboard is None:
+        _leaderboard = Leaderboard(get_store())
+    return _leaderboard
+
+
+# The shared leaderboard, or None while nothing has built it yet.
+def current_leaderboard():
+    return _leaderboard
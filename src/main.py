@@ -1,7 +1,9 @@
-import sqlite3 
+import os
+import time
+
+STARTED = time.perf_counter()  # Taken before Kivy is imported, for the startup report
 
 from kivy.app import App #App Base class for creating Kivy applications.
-from kivy.clock import Clock #Clock: Allows scheduling of function calls.
 from kivy.core.window import Window #Window: Provides access to window properties and methods.
 
 # Kivy UI components and screen management tools.
@@ -9,21 +11,38 @@ from kivy.uix.button import Button
 from kivy.uix.floatlayout import FloatLayout
 from kivy.uix.textinput import TextInput
 from kivy.uix.label import Label
+from kivy.uix.recycleboxlayout import RecycleBoxLayout
+from kivy.uix.recycleview import RecycleView
 from kivy.uix.screenmanager import ScreenManager, Screen, NoTransition #NoTransition: A screen transition class that disables transitions between screens.
 from kivy.properties import ObjectProperty
 
+from kivy.clock import Clock
+from kivy.logger import Logger
+
 from constants import *
-from core import GameWidget 
-from storage import create_table 
+from profiler import TRACE_PATH, profiler
+from storage import close_store
+
+# Screens other than the menu import their modules when they are first built: the game pulls in
+# NumPy, Pillow and the asset cache, the score screens open the database.
 
 # Set the initial size of the application window based on constants defined in constants.py.
 Window.size = (SCREEN_WIDTH, SCREEN_HEIGHT)
 
+HELP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'help_text.txt')
 
-file = open("src/help_text.txt", "r")
+# Set CANNON_STARTUP_REPORT=1 to log the time to the first frame and quit right after it; the exit
+# status is 1 when it took longer than STARTUP_BUDGET seconds.
+STARTUP_REPORT = bool(os.environ.get('CANNON_STARTUP_REPORT'))
+STARTUP_BUDGET = 1.0
+
+# Set CANNON_REPLAY=<replay id> to open straight into that game's replay (see replay.py), watched at
+# CANNON_REPLAY_SPEED times real time.
+REPLAY_ID = os.environ.get('CANNON_REPLAY')
+REPLAY_SPEED = float(os.environ.get('CANNON_REPLAY_SPEED', 1.0))
 
 # MainMenuScreen Contains buttons for starting a game, continuing a game, viewing high scores, and accessing help.
-# Methods like start_game, continue_game, show_high_scores, show_help handle button presses to switch screens or start game logic.
+# Methods like start_game, continue_game, show_high_scores, show_statistics, show_help handle button presses to switch screens or start game logic.
 class MainMenuScreen(Screen):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
@@ -39,10 +58,15 @@ class MainMenuScreen(Screen):
         layout.add_widget(self.continue_button)
 
         high_scores_button = Button(text="High Scores", size_hint=(0.2, 0.1),
-                                    pos_hint={'center_x': 0.5, 'center_y': 0.3})
+                                    pos_hint={'center_x': 0.39, 'center_y': 0.3})
         high_scores_button.bind(on_press=self.show_high_scores)
         layout.add_widget(high_scores_button)
 
+        statistics_button = Button(text="Statistics", size_hint=(0.2, 0.1),
+                                   pos_hint={'center_x': 0.61, 'center_y': 0.3})
+        statistics_button.bind(on_press=self.show_statistics)
+        layout.add_widget(statistics_button)
+
         help_button = Button(text="Help", size_hint=(0.2, 0.1), pos_hint={'center_x': 0.5, 'center_y': 0.1})
         help_button.bind(on_press=self.show_help)
         layout.add_widget(help_button)
@@ -57,21 +81,23 @@ class MainMenuScreen(Screen):
         pass
 
     def continue_game(self, instance):
-        if self.manager.get_screen('game').game_widget.time_left > 0:
+        if self.manager.has_screen('game') and self.manager.get_screen('game').game_widget.time_left > 0:
             self.manager.get_screen('game').game_widget.game_over = False
-            self.manager.get_screen('game').game_widget.timer_event = Clock.schedule_interval(
-                self.manager.get_screen('game').game_widget.update_time, 1)
             self.manager.current = 'game'
 
     def show_high_scores(self, instance):
         self.manager.current = 'high_scores'
 
+    def show_statistics(self, instance):
+        self.manager.current = 'statistics'
+
     def show_help(self, instance):
         self.manager.current = 'help'
 
 
-# HighScoresScreen Displays high scores fetched from an SQLite database (scores.db).
-# Uses update_scores to query and display top scores.
+# HighScoresScreen Displays the leaderboard kept by leaderboard.py, refreshed every time the screen is entered.
+# The list is a RecycleView, so only the visible rows have widgets; scrolling near the bottom loads the next
+# page of older games (load_more) until the whole history has been shown.
 # Includes a back button (go_back) to return to the main menu.
 class HighScoresScreen(Screen):
     def __init__(self, **kwargs):
@@ -79,35 +105,109 @@ class HighScoresScreen(Screen):
         layout = FloatLayout()
 
         self.scores_label = Label(text="High Scores", size_hint=(None, None),
-                                  pos_hint={'center_x': 0.5, 'center_y': 0.8}, font_size='20sp')
+                                  pos_hint={'center_x': 0.5, 'center_y': 0.9}, font_size='20sp')
         layout.add_widget(self.scores_label)
 
-        back_button = Button(text="Back", size_hint=(0.2, 0.1), pos_hint={'center_x': 0.5, 'center_y': 0.2})
+        self.scores_list = RecycleView(viewclass='Label', size_hint=(0.9, 0.6),
+                                       pos_hint={'center_x': 0.5, 'center_y': 0.52})
+        rows = RecycleBoxLayout(orientation='vertical', default_size=(None, 30), default_size_hint=(1, None),
+                                size_hint_y=None)
+        rows.bind(minimum_height=rows.setter('height'))
+        self.scores_list.add_widget(rows)
+        self.scores_list.bind(scroll_y=self.on_scroll)
+        layout.add_widget(self.scores_list)
+
+        back_button = Button(text="Back", size_hint=(0.2, 0.1), pos_hint={'center_x': 0.5, 'center_y': 0.1})
         back_button.bind(on_press=self.go_back)
         layout.add_widget(back_button)
 
         self.add_widget(layout)
+        self.last_row = None
+        self.exhausted = False
+
+    def on_pre_enter(self):
         self.update_scores()
 
     def go_back(self, instance):
         self.manager.current = 'menu'
 
     def update_scores(self):
-        try:
-            conn = sqlite3.connect('scores.db')
-            cursor = conn.cursor()
-            cursor.execute(
-                'SELECT score, date, shots, hits, accuracy FROM scores ORDER BY accuracy DESC, score DESC LIMIT 10')
-            scores = cursor.fetchall()
-            conn.close()
+        from leaderboard import LEADERBOARD_SIZE, get_leaderboard
+        scores = get_leaderboard().top()
+        self.scores_label.text = "High Scores:" if scores else "No scores available."
+        self.scores_list.data = []
+        self.last_row = None
+        self.exhausted = len(scores) < LEADERBOARD_SIZE
+        self.show_rows(scores)
+        self.scores_list.scroll_y = 1
+        # The cached top alone is too short to scroll, so the first page below it is loaded right away.
+        if not self.exhausted:
+            self.load_more()
+
+    # Loads the page below the last row shown; scroll_y reaches 0 at the bottom of the list.
+    def on_scroll(self, instance, scroll_y):
+        if scroll_y <= 0.05 and not self.exhausted and self.last_row is not None:
+            self.load_more()
+
+    def load_more(self):
+        from leaderboard import PAGE_SIZE, get_leaderboard
+        rows = get_leaderboard().page(self.last_row)
+        self.exhausted = len(rows) < PAGE_SIZE
+        self.show_rows(rows)
+
+    def show_rows(self, rows):
+        start = len(self.scores_list.data)
+        self.scores_list.data.extend(
+            {'text': f"{start + i + 1}. Score: {score}, Date: {date}, Shots: {shots}, Hits: {hits}, Accuracy: {accuracy:.2f}"}
+            for i, (game_id, score, date, shots, hits, accuracy) in enumerate(rows))
+        if rows:
+            self.last_row = rows[-1]
+
+
+# StatisticsScreen Shows trends over the whole score history: totals, score percentiles, recent daily and weekly
+# accuracy, and score and accuracy histograms. It only reads the summary tables kept by stats.py, refreshed
+# every time the screen is entered.
+# Includes a back button (go_back) to return to the main menu.
+class StatisticsScreen(Screen):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        layout = FloatLayout()
+
+        self.stats_label = Label(text="Statistics", size_hint=(0.9, 0.75), pos_hint={'center_x': 0.5, 'center_y': 0.55},
+                                 halign='left', valign='top')
+        self.stats_label.bind(size=self.stats_label.setter('text_size'))
+        layout.add_widget(self.stats_label)
+
+        back_button = Button(text="Back", size_hint=(0.2, 0.1), pos_hint={'center_x': 0.5, 'center_y': 0.1})
+        back_button.bind(on_press=self.go_back)
+        layout.add_widget(back_button)
+
+        self.add_widget(layout)
+
+    def on_pre_enter(self):
+        self.update_stats()
 
-            scores_text = "High Scores:\n\n"
-            for i, (score, date, shots, hits, accuracy) in enumerate(scores):
-                scores_text += f"{i + 1}. Score: {score}, Date: {date}, Shots: {shots}, Hits: {hits}, Accuracy: {accuracy:.2f}\n"
+    def go_back(self, instance):
+        self.manager.current = 'menu'
 
-            self.scores_label.text = scores_text
-        except sqlite3.OperationalError:
-            self.scores_label.text = "No scores available."
+    def update_stats(self):
+        from stats import Stats
+        stats = Stats()
+        games, shots, hits, accuracy, average, best = stats.totals()
+        if not games:
+            self.stats_label.text = "No scores available."
+            return
+
+        text = f"Statistics:\n\nGames: {games}, Shots: {shots}, Hits: {hits}, Accuracy: {accuracy:.2f}, " \
+               f"Average score: {average:.1f}, Best score: {best}\n"
+        text += "Score percentiles: " + ", ".join(f"p{rank}: {score}" for rank, score in stats.percentiles().items()) + "\n"
+        for period, title in (('day', "Last days"), ('week', "Last weeks")):
+            text += f"\n{title}:\n"
+            for key, games, accuracy, average, best in stats.trend(period):
+                text += f"{key}: Games: {games}, Accuracy: {accuracy:.2f}, Average score: {average:.1f}, Best: {best}\n"
+        text += "\nScores: " + ", ".join(f"{low}-{high}: {games}" for low, high, games in stats.score_histogram())
+        text += "\nAccuracy: " + ", ".join(f"{i / 10:.1f}+: {games}" for i, games in enumerate(stats.accuracy_histogram()))
+        self.stats_label.text = text
 
 
 # HelpScreen Provides instructions on how to play the game.
@@ -117,8 +217,8 @@ class HelpScreen(Screen):
         super().__init__(**kwargs)
         layout = FloatLayout()
 
-        help_text = file.read()
-        file.close()
+        with open(HELP_PATH) as file:
+            help_text = file.read()
         help_label = Label(text=help_text, size_hint=(0.8, 0.8), pos_hint={'center_x': 0.5, 'center_y': 0.5})
         layout.add_widget(help_label)
 
@@ -144,6 +244,7 @@ class GameScreen(Screen):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         layout = FloatLayout()
+        from core import GameWidget
         self.game_widget = GameWidget(screen_manager=self.manager)
         layout.add_widget(self.game_widget)
 
@@ -200,10 +301,29 @@ class GameScreen(Screen):
         back_button.bind(on_press=self.back_to_menu)
         layout.add_widget(back_button)
 
+        # Debug overlay, only when the profiler is on (see profiler.py)
+        if profiler.enabled:
+            self.profile_label = Label(size_hint=(0.5, 0.3), pos_hint={'x': 0.01, 'y': 0.45}, halign='left',
+                                       valign='top', font_name='RobotoMono-Regular', font_size='12sp',
+                                       color=(0, 0, 0, 1))
+            self.profile_label.bind(size=self.profile_label.setter('text_size'))
+            layout.add_widget(self.profile_label)
+            Clock.schedule_interval(self.update_profile, 0.5)
+
         self.add_widget(layout)
 
+    def update_profile(self, dt):
+        self.profile_label.text = profiler.report()
+
     def on_pre_enter(self):
         self.game_widget.screen_manager = self.manager
+
+    # The game loop only runs while this screen is shown.
+    def on_enter(self):
+        self.game_widget.loop.start()
+
+    def on_leave(self):
+        self.game_widget.stop_game()
     
     def set_custom_velocity(self, *args):
         self.game_widget.set_custom_velocity(self.velocity_input.text)
@@ -212,21 +332,60 @@ class GameScreen(Screen):
         self.game_widget.stop_game()
         self.manager.current = 'menu'
 
-# Calls create_table() to initialize the SQLite database.
-# Adds instances of MainMenuScreen, GameScreen, HighScoresScreen, and HelpScreen to the ScreenManager.
+# Screens that ScreenManager builds on first use. Each name is registered with its screen class and the
+# screen is only constructed when something asks for it (get_screen, or switching to it), so startup
+# only pays for the main menu.
+class LazyScreenManager(ScreenManager):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.factories = {}
+
+    def register(self, name, factory):
+        self.factories[name] = factory
+
+    def get_screen(self, name):
+        if name in self.factories and not self.has_screen(name):
+            self.add_widget(self.factories.pop(name)(name=name))
+        return super().get_screen(name)
+
+
+# Registers MainMenuScreen, GameScreen, HighScoresScreen, StatisticsScreen, and HelpScreen and opens the main
+# menu; the other screens, the score database and the background writer are created on first use.
+# On exit, pending score writes are flushed before the app closes.
 class MyApp(App):
     def build(self):
-        create_table()
-
-        sm = ScreenManager(transition=NoTransition())
-        sm.add_widget(MainMenuScreen(name='menu'))
-        sm.add_widget(GameScreen(name='game'))
-        sm.add_widget(HighScoresScreen(name='high_scores'))
-        sm.add_widget(HelpScreen(name='help'))
+        self.startup_time = None  # Set once the first frame is on screen
+        sm = LazyScreenManager(transition=NoTransition())
+        sm.register('menu', MainMenuScreen)
+        sm.register('game', GameScreen)
+        sm.register('high_scores', HighScoresScreen)
+        sm.register('statistics', StatisticsScreen)
+        sm.register('help', HelpScreen)
+        sm.current = 'menu'
+        if REPLAY_ID:
+            from replay import load
+            sm.get_screen('game').game_widget.start_replay(load(REPLAY_ID), REPLAY_SPEED)
+            sm.current = 'game'
+        Window.bind(on_flip=self.on_first_frame)
         return sm
 
+    # Logs the startup report once the first frame is on screen.
+    def on_first_frame(self, window):
+        Window.unbind(on_flip=self.on_first_frame)
+        self.startup_time = time.perf_counter() - STARTED
+        Logger.info(f'Startup: first frame after {self.startup_time * 1000:.0f} ms (budget {STARTUP_BUDGET * 1000:.0f} ms)')
+        if STARTUP_REPORT:
+            self.stop()
+
+    def on_stop(self):
+        close_store()
+        if profiler.enabled:
+            profiler.export(TRACE_PATH)
+
 # Entry point of the application. Creates an instance of MyApp and starts the Kivy application loop.
 if __name__ == "__main__":
     app = MyApp()
     app.run()
-
+    # No startup time if the app stopped before its first frame.
+    if STARTUP_REPORT and app.startup_time is not None and app.startup_time > STARTUP_BUDGET:
+        raise SystemExit(1)
@@ -0,0 +1,138 @@
+import numpy as np
+
+PARTICLE_CAPACITY = 2048  # Particles alive at once; past that, new ones replace the oldest
+
+# Impact effects, one list of particle emissions per thing that can be hit. count particles start at the
+# impact point and fly off at up to speed px/s (0 for a flash that stays put), pulled down by gravity.
+# They live up to life seconds while their size goes from size[0] to size[1] and their color fades out.
+IMPACTS = {
+    "target": (
+        {'count': 1, 'speed': 0, 'gravity': 0, 'life': 0.4, 'size': (60, 110), 'color': (1, 1, 1, 1)},
+        {'count': 24, 'speed': 320, 'gravity': -400, 'life': 0.5, 'size': (16, 3), 'color': (1, 0.7, 0.3, 1)},
+    ),
+    "stone": (
+        {'count': 1, 'speed': 0, 'gravity': 0, 'life': 0.3, 'size': (40, 80), 'color': (0.9, 0.85, 0.8, 0.8)},
+        {'count': 16, 'speed': 220, 'gravity': -600, 'life': 0.5, 'size': (12, 4), 'color': (0.6, 0.55, 0.5, 1)},
+    ),
+    "mirror": (
+        {'count': 1, 'speed': 0, 'gravity': 0, 'life': 0.3, 'size': (40, 90), 'color': (0.8, 0.95, 1, 0.9)},
+        {'count': 20, 'speed': 280, 'gravity': -200, 'life': 0.4, 'size': (10, 2), 'color': (0.6, 0.9, 1, 1)},
+    ),
+}
+
+
+# Visual-only particles, such as the bursts of impacts, kept in preallocated struct-of-arrays ring
+# buffers. emit() writes new particles over the oldest rows, so any number of effects can overlap and
+# none of them allocates anything or schedules a Clock event; update() moves, ages and fades every row
+# in one vectorized pass. The cost of a frame is therefore bounded by capacity, however many impacts
+# happen at once. A row is dead once its age reaches its life; dead rows keep a size of zero. As rows
+# are written in order, the live ones all lie among the span rows just before head (see window()), which
+# is all a renderer has to draw.
+#
+# Particles do not need to be random: every row has a fixed direction and speed/life scale, drawn once
+# from a seeded generator, and the head moving around the ring spreads each burst over them.
+class ParticleSystem:
+
+    def __init__(self, capacity=PARTICLE_CAPACITY, seed=0):
+        self.capacity = capacity
+        self.head = 0  # Next row to write
+        self.count = 0  # Live particles after the last update()
+        self.span = 0  # Rows before head that may still be alive
+
+        self.pos = np.zeros((capacity, 2))
+        self.vel = np.zeros((capacity, 2))
+        self.gravity = np.zeros(capacity)
+        self.age = np.full(capacity, np.inf)
+        self.life = np.ones(capacity)
+        self.start_size = np.zeros(capacity)
+        self.end_size = np.zeros(capacity)
+        self.start_color = np.zeros((capacity, 4))
+
+        # Drawn every frame: current size and color.
+        self.size = np.zeros(capacity)
+        self.color = np.zeros((capacity, 4))
+
+        rng = np.random.default_rng(seed)
+        angle = rng.uniform(0, 2 * np.pi, capacity)
+        self.spread = np.stack([np.cos(angle), np.sin(angle)], axis=-1) * rng.uniform(0.3, 1, capacity)[:, None]
+        self.life_scale = rng.uniform(0.7, 1, capacity)
+
+        # Scratch space of update().
+        self.step = np.zeros((capacity, 2))
+        self.progress = np.zeros(capacity)
+        self.alive = np.zeros(capacity, dtype=bool)
+
+    # Row ranges of the next count rows, two when they wrap around the end of the ring.
+    def _ranges(self, count):
+        count = min(count, self.capacity)
+        start = self.head
+        self.head = (start + count) % self.capacity
+        if start + count <= self.capacity:
+            return ((start, start + count),)
+        return (start, self.capacity), (0, start + count - self.capacity)
+
+    # Starts spec['count'] particles at pos; spec is one emission of IMPACTS.
+    def emit(self, pos, spec):
+        for start, stop in self._ranges(spec['count']):
+            self.pos[start:stop] = pos
+            np.multiply(self.spread[start:stop], spec['speed'], out=self.vel[start:stop])
+            self.gravity[start:stop] = spec['gravity']
+            self.age[start:stop] = 0
+            np.multiply(self.life_scale[start:stop], spec['life'], out=self.life[start:stop])
+            self.start_size[start:stop] = spec['size'][0]
+            self.end_size[start:stop] = spec['size'][1]
+            self.start_color[start:stop] = spec['color']
+        self.count += spec['count']
+        self.span = min(self.span + spec['count'], self.capacity)
+
+    # The effect of an impact on kind ("target", "stone" or "mirror") at pos.
+    def burst(self, kind, pos):
+        for spec in IMPACTS[kind]:
+            self.emit(pos, spec)
+
+    # Advances every particle by dt seconds. Does nothing while none is alive.
+    def update(self, dt):
+        if not self.count:
+            return
+        np.multiply(self.gravity, dt, out=self.progress)
+        self.vel[:, 1] += self.progress
+        np.multiply(self.vel, dt, out=self.step)
+        self.pos += self.step
+        self.age += dt
+
+        np.less(self.age, self.life, out=self.alive)
+        np.divide(self.age, self.life, out=self.progress)
+        np.minimum(self.progress, 1, out=self.progress)
+        np.subtract(self.end_size, self.start_size, out=self.size)
+        self.size *= self.progress
+        self.size += self.start_size
+        self.size *= self.alive
+        np.copyto(self.color, self.start_color)
+        np.subtract(1, self.progress, out=self.progress)
+        self.color[:, 3] *= self.progress
+        self.count = int(np.count_nonzero(self.alive))
+        self._shrink()
+
+    # Row ranges of the live window, oldest first: one range, or two when it wraps around the ring.
+    def window(self):
+        start = self.head - self.span
+        if start >= 0:
+            return ((start, self.head),)
+        return (start + self.capacity, self.capacity), (0, self.head)
+
+    # Drops the dead rows at the old end of the window.
+    def _shrink(self):
+        for start, stop in self.window():
+            first = int(np.argmax(self.alive[start:stop])) if stop > start else 0
+            if stop > start and self.alive[start + first]:
+                self.span -= first
+                return
+            self.span -= stop - start
+
+    # Kills every particle, e.g. when a new game starts.
+    def clear(self):
+        self.age[:] = np.inf
+        self.size[:] = 0
+        self.alive[:] = False
+        self.count = 0
+        self.span = 0
@@ -0,0 +1,131 @@
+import json
+import os
+import time
+from collections import deque
+
+PROFILE_WINDOW = 300  # Samples per phase in the rolling percentile window (5 s at 60 FPS)
+TRACE_LIMIT = 200000  # Trace events kept for export; older ones are dropped
+PERCENTILES = (50, 95, 99)
+
+
+class _NullPhase:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_PHASE = _NullPhase()
+
+
+# Percentile (0..100) of an ascending list, interpolated linearly between the closest ranks like
+# NumPy's default. Plain Python keeps NumPy off the start-up path (main.py imports the profiler).
+def percentile(ordered, rank):
+    position = (len(ordered) - 1) * rank / 100
+    low = int(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+
+class _Phase:
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, self.start, time.perf_counter_ns())
+        return False
+
+
+# Opt-in frame profiler. Code under measurement wraps a phase in "with profiler.phase(name):" and
+# reports per-frame values with profiler.count(name, value). While disabled, phase() hands back a
+# shared no-op context manager and count() returns at once, so the hooks can stay in the hot path.
+# While enabled, every phase keeps a rolling window of its last PROFILE_WINDOW durations for
+# percentiles, and every sample is also kept as a Chrome trace event for export().
+class Profiler:
+
+    def __init__(self, enabled=False, window=PROFILE_WINDOW):
+        self.enabled = enabled
+        self.window = window
+        self.samples = {}  # Phase name -> [durations in ms (ring), samples recorded]
+        self.counters = {}
+        self.trace = deque(maxlen=TRACE_LIMIT)
+        self.origin = time.perf_counter_ns()
+
+    # Drops everything recorded so far, optionally resizing the percentile window.
+    def reset(self, window=None):
+        self.window = window or self.window
+        self.samples.clear()
+        self.counters.clear()
+        self.trace.clear()
+
+    def phase(self, name):
+        if not self.enabled:
+            return NULL_PHASE
+        return _Phase(self, name)
+
+    # Records a phase that ran from start to end (perf_counter_ns values).
+    def record(self, name, start, end):
+        ring = self.samples.get(name)
+        if ring is None:
+            ring = self.samples[name] = [[0.0] * self.window, 0]
+        ring[0][ring[1] % self.window] = (end - start) / 1e6
+        ring[1] += 1
+        self.trace.append(('X', name, start, end - start))
+
+    def count(self, name, value):
+        if not self.enabled:
+            return
+        self.counters[name] = value
+        self.trace.append(('C', name, time.perf_counter_ns(), value))
+
+    # {percentile: ms} over the rolling window of a phase.
+    def percentiles(self, name, ranks=PERCENTILES):
+        durations, recorded = self.samples[name]
+        ordered = sorted(durations[:min(recorded, self.window)])
+        return {rank: percentile(ordered, rank) for rank in ranks}
+
+    # {phase: {'count', 'total_ms', 'p50', 'p95', 'p99'}}, machine-readable; total_ms covers the whole
+    # rolling window only.
+    def summary(self):
+        result = {}
+        for name, (durations, recorded) in self.samples.items():
+            result[name] = {'count': recorded, 'total_ms': sum(durations[:min(recorded, self.window)])}
+            result[name].update((f'p{rank}', ms) for rank, ms in self.percentiles(name).items())
+        return result
+
+    # One line per phase and one for the counters, for the debug overlay.
+    def report(self):
+        lines = []
+        for name in self.samples:
+            values = " ".join(f"p{rank} {ms:6.2f}" for rank, ms in self.percentiles(name).items())
+            lines.append(f"{name:<10} {values} ms")
+        if self.counters:
+            lines.append("  ".join(f"{name}: {value}" for name, value in self.counters.items()))
+        return "\n".join(lines)
+
+    # Writes the recorded events as Chrome trace JSON (chrome://tracing, Perfetto).
+    def export(self, path):
+        events = []
+        for kind, name, start, value in self.trace:
+            event = {'name': name, 'ph': kind, 'ts': (start - self.origin) / 1000, 'pid': os.getpid(), 'tid': 0}
+            if kind == 'X':
+                event['dur'] = value / 1000
+            else:
+                event['args'] = {name: value}
+            events.append(event)
+        with open(path, 'w') as file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, file)
+
+
+# Set CANNON_PROFILE=<trace.json> to turn the profiler on: the game shows its overlay and writes the
+# trace to that file on exit.
+TRACE_PATH = os.environ.get('CANNON_PROFILE')
+profiler = Profiler(enabled=bool(TRACE_PATH))
@@ -0,0 +1,131 @@
+import heapq
+
+import numpy as np
+
+from ballistics import position
+
+
+# Projectile type codes stored in ProjectileBuffer.type.
+CANNON = 0
+PISTOL = 1
+PISTOL_HIT_STONE = 2
+
+TYPE_CODES = {
+    "cannon": CANNON,
+    "pistol": PISTOL,
+    "pistol_hit_stone": PISTOL_HIT_STONE,
+}
+TYPE_NAMES = {code: name for name, code in TYPE_CODES.items()}
+
+
+# Struct-of-arrays pool for every projectile in flight. Rows are recycled through a free list (a
+# min-heap, so live rows stay packed at the bottom): a dead row is only flagged, never moved, and
+# the next shot reuses it. Firing therefore allocates nothing once the pool has warmed up. Live
+# rows all lie below end; count is the number of live rows. ids are unique per shot.
+#
+# A row stores the launch of its flight (origin, vel0, gravity and launch time t0), not a per-tick
+# position: positions are evaluated in closed form when needed. impact_t is the scheduled time of
+# the next contact, impact_box the index of the obstacle it touches (-1 for none) and impact_axis
+# the normal of the face it crosses. expire_t is when the shot leaves the field for good or
+# reaches its weapon's lifetime, whichever comes first. shot is the shot's sequence number in the
+# world's ShotLog.
+class ProjectileBuffer:
+
+    def __init__(self, capacity=256):
+        self.count = 0
+        self.end = 0
+        self.free = []
+        self.next_id = 0
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        self.origin = np.zeros((capacity, 2))
+        self.vel0 = np.zeros((capacity, 2))
+        self.gravity = np.zeros(capacity)
+        self.t0 = np.zeros(capacity)
+        self.size = np.zeros((capacity, 2))
+        self.angle = np.zeros(capacity)
+        self.type = np.zeros(capacity, dtype=np.int8)
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.impact_t = np.full(capacity, np.inf)
+        self.impact_box = np.full(capacity, -1, dtype=np.int32)
+        self.impact_axis = np.zeros(capacity, dtype=np.int8)
+        self.expire_t = np.full(capacity, np.inf)
+        self.shot = np.zeros(capacity, dtype=np.int64)
+
+    def _arrays(self):
+        return (self.origin, self.vel0, self.gravity, self.t0, self.size, self.angle, self.type, self.alive,
+                self.ids, self.impact_t, self.impact_box, self.impact_axis, self.expire_t, self.shot)
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def capacity(self):
+        return len(self.alive)
+
+    def _grow(self):
+        old = self._arrays()
+        self._allocate(self.capacity * 2)
+        for new, previous in zip(self._arrays(), old):
+            new[:self.end] = previous[:self.end]
+
+    # Takes a row from the pool for a projectile launched at time t0 and returns it; the caller
+    # schedules its impact and expiry.
+    def add(self, origin, velocity, gravity, t0, size, type, angle=0, shot=-1):
+        if self.free:
+            i = heapq.heappop(self.free)
+        else:
+            if self.end == self.capacity:
+                self._grow()
+            i = self.end
+            self.end += 1
+        self.origin[i] = origin
+        self.vel0[i] = velocity
+        self.gravity[i] = gravity
+        self.t0[i] = t0
+        self.size[i] = size
+        self.angle[i] = angle
+        self.type[i] = TYPE_CODES[type]
+        self.alive[i] = True
+        self.ids[i] = self.next_id
+        self.impact_t[i] = np.inf
+        self.impact_box[i] = -1
+        self.expire_t[i] = np.inf
+        self.shot[i] = shot
+        self.next_id += 1
+        self.count += 1
+        return i
+
+    # Returns row i to the pool.
+    def kill(self, i):
+        self.alive[i] = False
+        self.impact_t[i] = np.inf
+        self.expire_t[i] = np.inf
+        self.count -= 1
+        if self.count == 0:
+            self.end = 0
+            self.free.clear()
+        else:
+            heapq.heappush(self.free, i)
+
+    # Live row indices, in row order.
+    def live(self):
+        return np.flatnonzero(self.alive[:self.end])
+
+    # Positions of rows [0, end) at time t (scalar or one time per row); dead rows hold stale values.
+    def positions(self, t):
+        n = self.end
+        return position(self.origin[:n], self.vel0[:n], self.gravity[:n], t - self.t0[:n])
+
+    def position_of(self, i, t):
+        return position(self.origin[i], self.vel0[i], self.gravity[i], t - self.t0[i])
+
+    def clear(self):
+        self.alive[:self.end] = False
+        self.impact_t[:self.end] = np.inf
+        self.expire_t[:self.end] = np.inf
+        self.count = 0
+        self.end = 0
+        self.free.clear()
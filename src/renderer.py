@@ -0,0 +1,284 @@
+import numpy as np
+from kivy.graphics import Color, InstructionGroup, Line, Mesh, Rectangle, RenderContext
+
+from assets import get_assets
+from projectiles import CANNON, PISTOL, PISTOL_HIT_STONE
+
+
+# Atlas sprite drawn for each projectile type code.
+PROJECTILE_SPRITES = {
+    CANNON: "ball",
+    PISTOL: "bullet",
+    PISTOL_HIT_STONE: "bullet",
+}
+
+LASER_COLOR = (1, 0.2, 0.2, 1)
+
+WEAPON_SPRITES = {
+    "cannon": "cannon",
+    "pistol": "pistol",
+    "laser": "laser_gun",
+}
+
+# Vertex layout of a SpriteBatch: the corner offset from the sprite's rotation origin, its texture
+# coordinates, and the origin and rotation (radians) of the sprite it belongs to.
+SPRITE_FORMAT = [
+    (b'vPosition', 2, 'float'),
+    (b'vTexCoords0', 2, 'float'),
+    (b'vCenter', 2, 'float'),
+    (b'vAngle', 1, 'float'),
+]
+
+# Rotates each corner about its sprite's origin on the GPU. The fragment shader is Kivy's default.
+SPRITE_VERTEX_SHADER = """
+$HEADER$
+attribute vec2 vCenter;
+attribute float vAngle;
+
+void main(void) {
+    frag_color = color * vec4(1.0, 1.0, 1.0, opacity);
+    tex_coord0 = vTexCoords0;
+    float c = cos(vAngle);
+    float s = sin(vAngle);
+    vec2 pos = vCenter + vec2(c * vPosition.x - s * vPosition.y, s * vPosition.x + c * vPosition.y);
+    gl_Position = projection_mat * modelview_mat * vec4(pos, 0.0, 1.0);
+}
+"""
+
+
+# Vertex layout of a ParticleBatch: the corner offset from the particle's centre for a size of 1, its
+# texture coordinates, then the centre, size and color of the particle it belongs to.
+PARTICLE_FORMAT = [
+    (b'vPosition', 2, 'float'),
+    (b'vTexCoords0', 2, 'float'),
+    (b'vCenter', 2, 'float'),
+    (b'vSize', 1, 'float'),
+    (b'vColor', 4, 'float'),
+]
+
+# Scales each corner by its particle's size and tints it with its color on the GPU.
+PARTICLE_VERTEX_SHADER = """
+$HEADER$
+attribute vec2 vCenter;
+attribute float vSize;
+attribute vec4 vColor;
+
+void main(void) {
+    frag_color = vColor * vec4(1.0, 1.0, 1.0, opacity);
+    tex_coord0 = vTexCoords0;
+    gl_Position = projection_mat * modelview_mat * vec4(vCenter + vPosition * vSize, 0.0, 1.0);
+}
+"""
+
+
+# A group that can be shown or hidden. It keeps a fixed slot in its parent, so the draw order does not
+# change, and only a change of visibility touches the canvas tree.
+class Layer:
+    def __init__(self, parent, *instructions):
+        self.slot = InstructionGroup()
+        parent.add(self.slot)
+        self.group = InstructionGroup()
+        for instruction in instructions:
+            self.group.add(instruction)
+        self.visible = False
+
+    def show(self, visible=True):
+        if visible == self.visible:
+            return
+        if visible:
+            self.slot.add(self.group)
+        else:
+            self.slot.remove(self.group)
+        self.visible = visible
+
+
+# Any number of rotated sprites from one texture, drawn as a single Mesh inside its own RenderContext.
+# Rotation happens in SPRITE_VERTEX_SHADER, so the CPU only lays out unrotated corners and the scene
+# never touches the matrix stack, whatever the number of sprites.
+class SpriteBatch:
+
+    # Quad corners in sprite-local units, counter-clockwise from the bottom-left.
+    CORNERS = np.array([[0, 0], [1, 0], [1, 1], [0, 1]], dtype=float)
+    QUAD_INDICES = np.array([0, 1, 2, 2, 3, 0])
+
+    def __init__(self, texture):
+        self.context = RenderContext(use_parent_projection=True, use_parent_modelview=True)
+        self.context.shader.vs = SPRITE_VERTEX_SHADER
+        if not self.context.shader.success:
+            raise RuntimeError('Sprite shader failed to compile')
+        self.mesh = Mesh(fmt=SPRITE_FORMAT, mode='triangles', texture=texture)
+        self.context.add(self.mesh)
+        self.capacity = 0
+        self.indices = []
+
+    # Texture coordinates of a region of the batch texture, in CORNERS order.
+    @staticmethod
+    def uv(region):
+        return np.array(region.tex_coords, dtype=float).reshape(4, 2)
+
+    def _reserve(self, count):
+        if count <= self.capacity:
+            return
+        self.capacity = max(count, self.capacity * 2, 64)
+        offsets = np.repeat(np.arange(self.capacity) * 4, 6)
+        self.indices = (np.tile(self.QUAD_INDICES, self.capacity) + offsets).tolist()
+
+    # One sprite per row: rotation origin center (n, 2), angle in degrees (n,), corner offsets from
+    # the origin before rotation (n, 4, 2) and texture coordinates (n, 4, 2).
+    def update(self, center, angle, corners, uv):
+        count = len(center)
+        if count == 0:
+            self.mesh.indices = []
+            self.mesh.vertices = []
+            return
+        self._reserve(count)
+
+        vertices = np.empty((count, 4, 7))
+        vertices[:, :, 0:2] = corners
+        vertices[:, :, 2:4] = uv
+        vertices[:, :, 4:6] = center[:, None, :]
+        vertices[:, :, 6] = np.radians(angle)[:, None]
+        self.mesh.vertices = vertices.ravel().tolist()
+        self.mesh.indices = self.indices[:count * 6]
+
+
+# The live particles of a ParticleSystem, as one textured quad each in a single Mesh. The vertex data
+# lives in a float32 array sized for the system's capacity that the Mesh reads in place (through a
+# memoryview), and the quad indices never change: a frame copies the centre, size and color of the
+# particles in the system's live window to the front of it, one broadcast per column and range, and
+# draws that many quads. Dead particles within the window have a size of zero and cover no pixel.
+class ParticleBatch:
+
+    def __init__(self, particles, texture, region):
+        self.particles = particles
+        self.context = RenderContext(use_parent_projection=True, use_parent_modelview=True)
+        self.context.shader.vs = PARTICLE_VERTEX_SHADER
+        if not self.context.shader.success:
+            raise RuntimeError('Particle shader failed to compile')
+
+        capacity = particles.capacity
+        self.vertices = np.zeros((capacity, 4, 11), dtype=np.float32)
+        self.vertices[:, :, 0:2] = SpriteBatch.CORNERS - 0.5
+        self.vertices[:, :, 2:4] = SpriteBatch.uv(region)
+        offsets = np.repeat(np.arange(capacity) * 4, 6)
+        self.indices = (np.tile(SpriteBatch.QUAD_INDICES, capacity) + offsets).astype(np.uint16)
+        self.mesh = Mesh(fmt=PARTICLE_FORMAT, mode='triangles', texture=texture)
+        self.context.add(self.mesh)
+
+    def update(self):
+        particles = self.particles
+        count = 0
+        for start, stop in particles.window():
+            rows = self.vertices[count:count + stop - start]
+            rows[:, :, 4:6] = particles.pos[start:stop, None, :]
+            rows[:, :, 6] = particles.size[start:stop, None]
+            rows[:, :, 7:11] = particles.color[start:stop, None, :]
+            count += stop - start
+        self.mesh.vertices = memoryview(self.vertices[:count].ravel())
+        self.mesh.indices = memoryview(self.indices[:count * 6])
+
+
+# Retained scene for GameWidget. Every entity owns a persistent instruction (group) that is created
+# once; a frame only moves, rotates, shows or hides them. All projectiles are drawn by one SpriteBatch
+# and the weapon by another, so the instruction count stays constant however many bullets are in
+# flight. Likewise, every impact effect is a particle of one ParticleBatch. Sprites are regions of the
+# shared atlas (see assets.py): a frame binds the background and the atlas, nothing else.
+class SceneRenderer:
+
+    def __init__(self, canvas, world, particles):
+        self.world = world
+        assets = get_assets()
+
+        # Fixed draw order: background, scenery, bullets, laser beam, particles, weapon on top.
+        self.root = InstructionGroup()
+        self.background = Rectangle(texture=assets.texture("background"))
+        self.root.add(self.background)
+
+        self.table = Layer(self.root, Rectangle(texture=assets.texture("table"), pos=(10, 0), size=(86, 68)))
+        self.table.show()
+
+        self.target = Rectangle(texture=assets.texture("enemy"), pos=world.target.pos, size=world.target.size)
+        self.stone = Rectangle(texture=assets.texture("stone"), pos=world.stone.pos, size=world.stone.size)
+        self.mirror = Rectangle(texture=assets.texture("mirror"), pos=world.mirror.pos, size=world.mirror.size)
+        self.perpetitos = [Rectangle(texture=assets.texture("perpetito"), pos=perpetito.pos, size=perpetito.size)
+                           for perpetito in world.perpetitos]
+        for rect in [self.target, self.stone, self.mirror] + self.perpetitos:
+            self.root.add(rect)
+
+        self.bullets = SpriteBatch(assets.atlas)
+        types = max(PROJECTILE_SPRITES) + 1
+        self.bullet_uv = np.zeros((types, 4, 2))
+        for type, sprite in PROJECTILE_SPRITES.items():
+            self.bullet_uv[type] = SpriteBatch.uv(assets.texture(sprite))
+        self.root.add(self.bullets.context)
+
+        self.beam_line = Line(width=2)
+        self.beam = Layer(self.root, Color(*LASER_COLOR), self.beam_line, Color(1, 1, 1, 1))
+
+        self.particle_batch = ParticleBatch(particles, assets.atlas, assets.texture("explosion"))
+        self.particles = Layer(self.root, self.particle_batch.context)
+
+        # The weapon turns about the centre of the cannon; its corners are laid out around that point.
+        gun = world.weapons["cannon"]
+        self.weapon_origin = np.array([[gun.pos[0] + gun.size[0] / 2, gun.pos[1] + gun.size[1] / 2]])
+        self.weapon_sprites = {}
+        for weapon, sprite in WEAPON_SPRITES.items():
+            box = world.weapons[weapon]
+            corners = np.array(box.pos) + SpriteBatch.CORNERS * box.size - self.weapon_origin
+            self.weapon_sprites[weapon] = (corners[None], SpriteBatch.uv(assets.texture(sprite))[None])
+        self.weapon_batch = SpriteBatch(assets.atlas)
+        self.weapon = None
+        self.weapon_angle = None
+        self.root.add(self.weapon_batch.context)
+
+        canvas.add(self.root)
+
+    def set_background(self, pos, size):
+        self.background.pos = pos
+        self.background.size = size
+
+    def set_weapon(self, weapon, angle):
+        if weapon == self.weapon and angle == self.weapon_angle:
+            return
+        corners, uv = self.weapon_sprites[weapon]
+        self.weapon_batch.update(self.weapon_origin, np.array([angle], dtype=float), corners, uv)
+        self.table.show(weapon == "cannon")
+        self.weapon = weapon
+        self.weapon_angle = angle
+
+    # Brings every instruction in line with the world and the particles; angle/weapon/beam come from the
+    # widget.
+    def draw(self, angle, weapon, beam=None):
+        world = self.world
+        self.set_weapon(weapon, angle)
+
+        self.target.pos = world.target.pos
+        self.stone.pos = world.stone.pos
+        self.mirror.pos = world.mirror.pos
+        for rect, box in zip(self.perpetitos, world.perpetitos):
+            rect.pos = box.pos
+
+        self.draw_bullets()
+
+        if beam:
+            self.beam_line.points = [coord for point in beam['points'] for coord in point]
+        self.beam.show(bool(beam))
+
+        if self.particle_batch.particles.count:
+            self.particle_batch.update()
+        self.particles.show(bool(self.particle_batch.particles.count))
+
+    # Instructions in the scene, nested groups included.
+    def instruction_count(self, group=None):
+        children = (group or self.root).children
+        return len(children) + sum(self.instruction_count(child) for child in children
+                                   if getattr(child, 'children', None))
+
+    def draw_bullets(self):
+        buf = self.world.projectiles
+        n = buf.end
+        alive = buf.alive[:n]
+        pos = self.world.render_positions()[alive]
+        size = buf.size[:n][alive]
+        self.bullets.update(pos, buf.angle[:n][alive], SpriteBatch.CORNERS * size[:, None, :],
+                            self.bullet_uv[buf.type[:n][alive]])
@@ -0,0 +1,120 @@
+import os
+import secrets
+import struct
+import sys
+import time
+
+from constants import *
+from simulation import World
+
+# Replays are stored in the project root, one file per game, named after the replay id kept with
+# the game's row in scores.db.
+REPLAY_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'replays')
+
+REPLAY_MAGIC = b'CRPL'
+REPLAY_VERSION = 1
+# File layout: a header (magic, version, seed, tick rate, end tick), then one record per input
+# (tick, input code from simulation.py, value), little endian. A 60 s game is a few kB.
+HEADER = struct.Struct('<4sBQHI')
+RECORD = struct.Struct('<IBi')
+
+
+# The inputs of one game, in the order they were made. A World replays the game exactly from its
+# seed, its length (end_tick, as World.end_tick) and these (tick, input, value) records, see
+# simulation.py. Records are packed as they come in, so recording an input is one struct pack into a
+# bytearray.
+class InputLog:
+
+    def __init__(self, seed, id=None, tick_rate=TICK_RATE, end_tick=GAME_TIME * TICK_RATE):
+        self.seed = seed
+        self.id = id or secrets.token_hex(8)
+        self.tick_rate = tick_rate
+        self.end_tick = end_tick
+        self.records = bytearray()
+
+    # Usable as World.recorder.
+    def __call__(self, tick, input, value):
+        self.records += RECORD.pack(tick, input, value)
+
+    def __len__(self):
+        return len(self.records) // RECORD.size
+
+    def events(self):
+        return list(RECORD.iter_unpack(bytes(self.records)))
+
+    def to_bytes(self):
+        header = HEADER.pack(REPLAY_MAGIC, REPLAY_VERSION, self.seed, self.tick_rate, self.end_tick)
+        return header + bytes(self.records)
+
+    @classmethod
+    def from_bytes(cls, data, id=None):
+        magic, version, seed, tick_rate, end_tick = HEADER.unpack_from(data)
+        if magic != REPLAY_MAGIC or version != REPLAY_VERSION:
+            raise ValueError(f'Not a version {REPLAY_VERSION} replay')
+        log = cls(seed, id, tick_rate, end_tick)
+        log.records = bytearray(data[HEADER.size:])
+        return log
+
+    # Writes the replay to directory (REPLAY_DIR by default) and returns its path.
+    def save(self, directory=None):
+        path = replay_path(self.id, directory)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as file:
+            file.write(self.to_bytes())
+        return path
+
+
+def replay_path(id, directory=None):
+    return os.path.join(directory or REPLAY_DIR, f'{id}.replay')
+
+
+def load(id, directory=None):
+    with open(replay_path(id, directory), 'rb') as file:
+        return InputLog.from_bytes(file.read(), id)
+
+
+# Feeds a log back into a World, as World.script: before each tick, every input recorded for that
+# tick (or earlier) is applied.
+class Player:
+
+    def __init__(self, log):
+        self.events = log.events()
+        self.next = 0
+
+    def feed(self, world):
+        events = self.events
+        while self.next < len(events) and events[self.next][0] <= world.tick:
+            tick, input, value = events[self.next]
+            world.apply(input, value)
+            self.next += 1
+
+
+# Sets up world to replay log from its first tick; the world is then advanced as usual, by any
+# amount of time per call, to watch it at any speed.
+def start(world, log):
+    if log.tick_rate != TICK_RATE:
+        raise ValueError(f'Replay was recorded at {log.tick_rate} ticks per second, not {TICK_RATE}')
+    world.reset(log.seed)
+    world.end_tick = log.end_tick
+    world.weapon = "cannon"
+    world.bullet_speed = 300
+    world.script = Player(log)
+
+
+# Replays a whole game headless, as fast as the CPU allows, and returns the finished World.
+def play(log, world=None):
+    world = world or World()
+    start(world, log)
+    while not world.over:
+        world.run_tick()
+    return world
+
+
+# Usage: python src/replay.py <replay id>
+if __name__ == '__main__':
+    log = load(sys.argv[1])
+    started = time.perf_counter()
+    world = play(log)
+    took = time.perf_counter() - started
+    print(f'Score: {world.score}, Shots: {world.shots}, Hits: {world.hits}, '
+          f'{world.tick} ticks in {took:.2f}s ({world.tick / took:.0f} ticks/s)')
@@ -0,0 +1,66 @@
+import time
+
+from kivy.clock import Clock
+from kivy.core.window import Window
+
+from profiler import profiler
+
+
+# Buttons currently held down. Rotation is applied once per frame from this state instead of each
+# button running its own Clock event.
+class InputState:
+    def __init__(self):
+        self.rotate_left = False
+        self.rotate_right = False
+
+    # -1 while only "<" is held, 1 while only ">" is held, 0 otherwise.
+    def rotation(self):
+        return int(self.rotate_right) - int(self.rotate_left)
+
+    def clear(self):
+        self.rotate_left = False
+        self.rotate_right = False
+
+
+# The single tick source of the game screen. tick(dt) is called once per rendered frame while the
+# loop runs. The Clock event is created once and start() only re-arms it, so starting twice (or
+# restarting a game) can never stack a second interval.
+# With the profiler on, the loop also times the whole tick ("update"), Kivy drawing the canvas and
+# swapping buffers after it ("render"), and the time between two buffer swaps ("frame").
+class GameLoop:
+    def __init__(self, tick):
+        self.tick = tick
+        self.event = Clock.create_trigger(self._frame, 0, interval=True)
+        self.tick_end = None
+        self.last_flip = None
+        if profiler.enabled:
+            Window.bind(on_flip=self._flipped)
+
+    def _frame(self, dt):
+        with profiler.phase('update'):
+            self.tick(dt)
+        self.tick_end = time.perf_counter_ns()
+
+    def _flipped(self, window):
+        now = time.perf_counter_ns()
+        if self.tick_end is not None:
+            profiler.record('render', self.tick_end, now)
+            self.tick_end = None
+        if self.last_flip is not None and self.running:
+            profiler.record('frame', self.last_flip, now)
+        self.last_flip = now
+
+    @property
+    def running(self):
+        return self.event.is_triggered
+
+    def start(self):
+        self.event()
+
+    def stop(self):
+        self.event.cancel()
+
+
+# Hands callback(result) to the Kivy main thread; lets worker threads report back to the UI.
+def run_on_main_thread(callback, result):
+    Clock.schedule_once(lambda dt: callback(result), 0)
@@ -0,0 +1,393 @@
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import random
+import secrets
+import signal
+import socket
+import struct
+import threading
+import time
+
+from constants import *
+from replay import InputLog
+from simulation import FIRE, MAX_SPEED, MIN_SPEED, ROTATE, SPEED, WEAPON, WEAPONS, World
+from storage import DB_PATH, ScoreWriter
+from telemetry import shot_rows
+
+# Headless multi-session server. Every worker process runs one asyncio event loop that holds any
+# number of sessions, each a World played by one TCP client, and steps all of them from a single
+# ticker; workers share the listening port (SO_REUSEPORT), so the kernel spreads connections over
+# them. Finished games are sent to the parent process, whose ScoreWriter stores them (and their
+# replays) several per transaction.
+#
+# Protocol: every message is a HEADER (type, payload length) followed by its payload, little endian.
+#   server -> client  WELCOME  once, on connect
+#                     DELTA    every SEND_EVERY ticks, what changed since the last delta
+#                     RESULT   once, at game over; the server then closes the connection
+#   client -> server  INPUT    one player input, the same codes as replays (see simulation.py)
+# A delta starts with the tick and a set of DELTA_* flags, followed by one section per flag:
+#   DELTA_COUNTS  score, shots, hits
+#   DELTA_GUN     angle, weapon index
+#   DELTA_BOXES   count, then (obstacle index, x, y) for each obstacle that moved
+#   DELTA_SHOTS   count, then the launch of each new projectile; clients move it in closed form
+#                 (ballistics.position) until it is reported gone
+#   DELTA_GONE    count, then the ids of projectiles that hit something or expired
+HEADER = struct.Struct('<BH')
+WELCOME = 1
+DELTA = 2
+RESULT = 3
+INPUT = 4
+
+WELCOME_BODY = struct.Struct('<IQHI')  # session id, seed, tick rate, end tick
+INPUT_BODY = struct.Struct('<Bi')  # input code, value
+RESULT_BODY = struct.Struct('<IIII')  # final tick, score, shots, hits
+
+DELTA_HEAD = struct.Struct('<IB')  # tick, flags
+COUNTS_BODY = struct.Struct('<III')
+GUN_BODY = struct.Struct('<fB')
+COUNT = struct.Struct('<H')
+BOX_BODY = struct.Struct('<Bff')
+SHOT_BODY = struct.Struct('<IB6f')  # id, type, origin x, y, velocity x, y, gravity, launch time
+GONE_BODY = struct.Struct('<I')
+
+DELTA_COUNTS = 1
+DELTA_GUN = 2
+DELTA_BOXES = 4
+DELTA_SHOTS = 8
+DELTA_GONE = 16
+
+PORT = 8765
+SEND_EVERY = 3  # Ticks per delta, 20 deltas per second at 60 ticks per second
+MAX_ITEMS = 1024  # Most shots (new or gone) in one delta; the rest goes in the next one
+SEND_BUFFER_LIMIT = 64 * 1024  # A client this far behind skips deltas until it catches up
+MAX_INPUTS_PER_TICK = 8  # Inputs of one client applied per tick, at most one of them FIRE; the rest are dropped
+
+logger = logging.getLogger(__name__)
+
+
+def message(type, payload=b''):
+    return HEADER.pack(type, len(payload)) + payload
+
+
+# One game on the server: a World driven by its client's inputs, recorded as a replay. The last state
+# sent to the client is kept so deltas only carry what changed.
+class Session:
+
+    def __init__(self, id, writer, end_tick):
+        self.id = id
+        self.writer = writer
+        self.world = World()
+        self.world.reset(secrets.randbits(63))
+        self.world.end_tick = end_tick
+        self.log = InputLog(self.world.seed, end_tick=end_tick)
+        self.world.recorder = self.log
+        self.sent_counts = None
+        self.sent_gun = None
+        self.sent_boxes = [None] * len(self.world.boxes)
+        self.sent_shots = set()
+        self.input_tick = -1  # Tick of the inputs counted in inputs
+        self.inputs = 0
+        self.fired = False
+
+    def welcome(self):
+        return message(WELCOME, WELCOME_BODY.pack(self.id, self.world.seed, TICK_RATE, self.world.end_tick))
+
+    # Applies one INPUT payload; malformed or out of range inputs are dropped, and so are inputs past
+    # MAX_INPUTS_PER_TICK or a second FIRE in the same tick, so no client can flood its shard.
+    def receive(self, payload):
+        if len(payload) != INPUT_BODY.size or self.world.over:
+            return
+        if self.world.tick != self.input_tick:
+            self.input_tick = self.world.tick
+            self.inputs = 0
+            self.fired = False
+        if self.inputs == MAX_INPUTS_PER_TICK:
+            return
+        self.inputs += 1
+        input, value = INPUT_BODY.unpack(payload)
+        if input == ROTATE and value in (-1, 0, 1):
+            self.world.set_rotation(value)
+        elif input == WEAPON and value in range(len(WEAPONS)):
+            self.world.set_weapon(WEAPONS[value])
+        elif input == SPEED and MIN_SPEED <= value <= MAX_SPEED:
+            self.world.set_speed(value)
+        elif input == FIRE and not self.fired:
+            self.fired = True
+            self.world.fire()
+
+    def delta(self):
+        world = self.world
+        flags = 0
+        parts = []
+        counts = (world.score, world.shots, world.hits)
+        if counts != self.sent_counts:
+            flags |= DELTA_COUNTS
+            parts.append(COUNTS_BODY.pack(*counts))
+            self.sent_counts = counts
+        gun = (world.angle, WEAPONS.index(world.weapon))
+        if gun != self.sent_gun:
+            flags |= DELTA_GUN
+            parts.append(GUN_BODY.pack(*gun))
+            self.sent_gun = gun
+
+        moved = [(i, box.pos) for i, box in enumerate(world.boxes) if box.pos != self.sent_boxes[i]]
+        if moved:
+            flags |= DELTA_BOXES
+            parts.append(COUNT.pack(len(moved)))
+            for i, pos in moved:
+                parts.append(BOX_BODY.pack(i, *pos))
+                self.sent_boxes[i] = pos
+
+        buf = world.projectiles
+        rows = buf.live()
+        live = dict(zip(buf.ids[rows].tolist(), rows.tolist()))
+        new = [id for id in live if id not in self.sent_shots][:MAX_ITEMS]
+        if new:
+            flags |= DELTA_SHOTS
+            parts.append(COUNT.pack(len(new)))
+            for id in new:
+                i = live[id]
+                parts.append(SHOT_BODY.pack(id, buf.type[i], *buf.origin[i], *buf.vel0[i], buf.gravity[i], buf.t0[i]))
+            self.sent_shots.update(new)
+        gone = [id for id in self.sent_shots if id not in live][:MAX_ITEMS]
+        if gone:
+            flags |= DELTA_GONE
+            parts.append(COUNT.pack(len(gone)))
+            parts.extend(GONE_BODY.pack(id) for id in gone)
+            self.sent_shots.difference_update(gone)
+        return message(DELTA, DELTA_HEAD.pack(world.tick, flags) + b''.join(parts))
+
+    def result(self):
+        world = self.world
+        return message(RESULT, RESULT_BODY.pack(world.tick, world.score, world.shots, world.hits))
+
+    # What the parent process stores: (score, shots, hits, shot log columns, replay bytes, replay id).
+    def record(self):
+        world = self.world
+        return world.score, world.shots, world.hits, world.shot_log.columns(), self.log.to_bytes(), self.log.id
+
+
+# The sessions of one worker process.
+class Shard:
+
+    def __init__(self, index, results, end_tick):
+        self.index = index
+        self.results = results
+        self.end_tick = end_tick
+        self.sessions = {}
+        self.next_id = 0
+
+    async def handle(self, reader, writer):
+        writer.get_extra_info('socket').setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.next_id += 1
+        session = Session(self.index << 24 | self.next_id, writer, self.end_tick)
+        self.sessions[session.id] = session
+        writer.write(session.welcome())
+        try:
+            while True:
+                type, length = HEADER.unpack(await reader.readexactly(HEADER.size))
+                payload = await reader.readexactly(length)
+                if type == INPUT:
+                    session.receive(payload)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            # A client that leaves before the end abandons its game, nothing is stored.
+            self.sessions.pop(session.id, None)
+            writer.close()
+
+    # Steps every session by the real time elapsed, in fixed ticks, and sends the deltas and results.
+    # A session that fails is dropped without its result; the others go on.
+    async def tick(self):
+        loop = asyncio.get_running_loop()
+        last = loop.time()
+        while True:
+            await asyncio.sleep(1 / TICK_RATE)
+            now = loop.time()
+            elapsed, last = now - last, now
+            for session in list(self.sessions.values()):
+                try:
+                    self.step(session, elapsed)
+                except Exception:
+                    logger.exception('Session %d failed, dropping it', session.id)
+                    self.sessions.pop(session.id, None)
+                    session.writer.close()
+
+    def step(self, session, elapsed):
+        world = session.world
+        tick = world.tick
+        world.advance(elapsed)
+        if world.over:
+            self.finish(session)
+        elif world.tick // SEND_EVERY != tick // SEND_EVERY:
+            if session.writer.transport.get_write_buffer_size() < SEND_BUFFER_LIMIT:
+                session.writer.write(session.delta())
+
+    def finish(self, session):
+        self.sessions.pop(session.id, None)
+        session.writer.write(session.delta())
+        session.writer.write(session.result())
+        session.writer.close()
+        self.results.put(session.record())
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle, host, port, reuse_port=hasattr(socket, 'SO_REUSEPORT'))
+        async with server:
+            await self.tick()
+
+
+def run_shard(index, host, port, results, end_tick):
+    try:
+        asyncio.run(Shard(index, results, end_tick).serve(host, port))
+    except KeyboardInterrupt:
+        pass
+
+
+# Stores finished games from every worker until it receives None.
+def store_results(results, writer, replay_dir=None):
+    while True:
+        result = results.get()
+        if result is None:
+            return
+        score, shots, hits, columns, replay, replay_id = result
+        log = InputLog.from_bytes(replay, replay_id)
+        writer.submit(lambda store, log=log: log.save(replay_dir), wait=True)
+        writer.save_score(score, shots, hits, shot_rows=shot_rows(columns), replay_id=replay_id, wait=True)
+
+
+# Runs workers shard processes on one port until interrupted. Without SO_REUSEPORT only one worker
+# can listen.
+def serve(host='127.0.0.1', port=PORT, workers=None, db=DB_PATH, replay_dir=None, game_time=GAME_TIME):
+    if not hasattr(socket, 'SO_REUSEPORT'):
+        workers = 1
+    workers = workers or os.cpu_count()
+    results = multiprocessing.Queue()
+    shards = [multiprocessing.Process(target=run_shard, args=(index, host, port, results, game_time * TICK_RATE),
+                                      name=f'shard-{index}', daemon=True)
+              for index in range(workers)]
+    for shard in shards:
+        shard.start()
+    # Started after the workers, which must not inherit the writer's thread and connection.
+    writer = ScoreWriter(db)
+    storer = threading.Thread(target=store_results, args=(results, writer, replay_dir), name='score-results')
+    storer.start()
+    print(f'Serving on {host}:{port} with {workers} worker processes')
+    # Ctrl+C and SIGTERM both stop the workers; finished games still get stored.
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        for shard in shards:
+            shard.join()
+    except KeyboardInterrupt:
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        for shard in shards:
+            shard.terminate()
+            shard.join()
+    finally:
+        results.put(None)
+        storer.join()
+        writer.close()
+
+
+# A scripted loopback client: plays one game with random inputs, rebuilding the game state from the
+# deltas. Returns (session id, result, state seen, bytes received, ticks per second seen).
+async def play_client(host, port, rng):
+    reader, writer = await asyncio.open_connection(host, port)
+    type, length = HEADER.unpack(await reader.readexactly(HEADER.size))
+    session_id, seed, tick_rate, end_tick = WELCOME_BODY.unpack(await reader.readexactly(length))
+    state = {'counts': (0, 0, 0), 'boxes': {}, 'shots': {}, 'tick': 0}
+    received = 0
+    started = time.perf_counter()
+
+    async def send_inputs():
+        while True:
+            await asyncio.sleep(rng.uniform(0.05, 0.5))
+            choice = rng.random()
+            if choice < 0.3:
+                input = INPUT_BODY.pack(ROTATE, rng.choice((-1, 0, 1)))
+            elif choice < 0.4:
+                input = INPUT_BODY.pack(WEAPON, rng.randrange(len(WEAPONS)))
+            elif choice < 0.45:
+                input = INPUT_BODY.pack(SPEED, rng.randint(100, 600))
+            else:
+                input = INPUT_BODY.pack(FIRE, 0)
+            writer.write(message(INPUT, input))
+
+    inputs = asyncio.create_task(send_inputs())
+    try:
+        while True:
+            type, length = HEADER.unpack(await reader.readexactly(HEADER.size))
+            payload = await reader.readexactly(length)
+            received += HEADER.size + length
+            if type == DELTA:
+                apply_delta(state, payload)
+            elif type == RESULT:
+                result = RESULT_BODY.unpack(payload)
+                break
+    finally:
+        inputs.cancel()
+        writer.close()
+    return session_id, result, state, received, result[0] / (time.perf_counter() - started)
+
+
+# Updates a client's view of the game with one DELTA payload.
+def apply_delta(state, payload):
+    state['tick'], flags = DELTA_HEAD.unpack_from(payload)
+    offset = DELTA_HEAD.size
+    if flags & DELTA_COUNTS:
+        state['counts'] = COUNTS_BODY.unpack_from(payload, offset)
+        offset += COUNTS_BODY.size
+    if flags & DELTA_GUN:
+        state['gun'] = GUN_BODY.unpack_from(payload, offset)
+        offset += GUN_BODY.size
+    for flag, body in ((DELTA_BOXES, BOX_BODY), (DELTA_SHOTS, SHOT_BODY), (DELTA_GONE, GONE_BODY)):
+        if not flags & flag:
+            continue
+        count, = COUNT.unpack_from(payload, offset)
+        offset += COUNT.size
+        for _ in range(count):
+            item = body.unpack_from(payload, offset)
+            offset += body.size
+            if flag == DELTA_BOXES:
+                state['boxes'][item[0]] = item[1:]
+            elif flag == DELTA_SHOTS:
+                state['shots'][item[0]] = item[1:]
+            else:
+                state['shots'].pop(item[0], None)
+
+
+# Plays clients games at once against a running server and prints what they saw.
+async def load_test(host, port, clients, seed=None):
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    games = await asyncio.gather(*(play_client(host, port, random.Random(rng.random())) for _ in range(clients)))
+    took = time.perf_counter() - started
+    consistent = sum(state['counts'] == result[1:] for session_id, result, state, received, rate in games)
+    rates = sorted(rate for *rest, rate in games)
+    received = sum(game[3] for game in games)
+    print(f'{clients} games in {took:.1f}s, {consistent} with deltas matching the result')
+    print(f'Ticks per second seen by clients: min {rates[0]:.1f}, median {rates[len(rates) // 2]:.1f} '
+          f'(target {TICK_RATE})')
+    print(f'Received {received / clients / took / 1024:.2f} KB/s per client')
+    return games
+
+
+# Usage: python src/server.py serve [--port N] [--workers N] [--db PATH] [--game-time S]
+#        python src/server.py loadtest [--port N] [--clients N]
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Headless multi-session game server.')
+    parser.add_argument('mode', choices=('serve', 'loadtest'))
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--workers', type=int, help='worker processes (default: one per core)')
+    parser.add_argument('--db', default=DB_PATH, help='score database of finished games')
+    parser.add_argument('--game-time', type=int, default=GAME_TIME, help='seconds per game')
+    parser.add_argument('--clients', type=int, default=100, help='loopback clients of the load test')
+    args = parser.parse_args()
+    if args.mode == 'serve':
+        serve(args.host, args.port, args.workers, args.db, game_time=args.game_time)
+    else:
+        asyncio.run(load_test(args.host, args.port, args.clients))
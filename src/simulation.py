@@ -0,0 +1,513 @@
+import math
+import random
+
+import numpy as np
+
+from ballistics import exit_time, first_contact, launch_angles
+from constants import *
+from profiler import profiler
+from projectiles import *
+from spatial import UniformGrid
+from telemetry import MISS, OUTCOME_CODES, ShotLog
+
+
+# Headless game rules. Nothing in this module imports Kivy, so a World can be stepped
+# as fast as the CPU allows (tests, bots, servers) while GameWidget only draws it.
+#
+# A game is deterministic: obstacles are placed by the world's own seeded RNG, time only moves in
+# fixed ticks, and the player's controls (rotation, weapon, speed, fire) go through World methods
+# that take effect between ticks. Replaying the seed and the controls with their tick numbers
+# (see replay.py) therefore reproduces the game exactly.
+#
+# Shots are event driven: when a projectile is fired (or reflected) the analytic solver in
+# ballistics.py finds its first contact with every obstacle, and a tick only handles the contacts
+# that fall inside it. Moving an obstacle reschedules just the shots it can affect. The laser is
+# hitscan: its whole beam is ray cast when it is fired and never enters the projectile buffer.
+
+
+# Axis-aligned box with a bottom-left pos and a size, the same shape as a Kivy Rectangle.
+# on_move is called with the box whenever pos changes, which keeps the broad phase in sync.
+class Box:
+    def __init__(self, pos, size, on_move=None):
+        self.size = tuple(size)
+        self.on_move = None
+        self.pos = pos
+        self.on_move = on_move
+
+    @property
+    def pos(self):
+        return self._pos
+
+    @pos.setter
+    def pos(self, pos):
+        self._pos = tuple(pos)
+        if self.on_move:
+            self.on_move(self)
+
+    def rect(self):
+        return self.pos + self.size
+
+
+# Refinement passes of World.aim; the muzzle moves with the angle, so the solution is iterated.
+AIM_ITERATIONS = 6
+
+# Player input codes, as recorded with World.recorder and replayed with World.apply().
+ROTATE = 0  # value: -1, 0 or 1, the held rotation direction
+WEAPON = 1  # value: index in WEAPONS
+SPEED = 2  # value: cannon launch speed, an int within MIN_SPEED..MAX_SPEED
+FIRE = 3
+
+WEAPONS = ["cannon", "pistol", "laser"]
+MIN_ANGLE = -45
+MAX_ANGLE = 80
+MIN_SPEED = 1
+MAX_SPEED = 10000
+
+# Sprite size of the projectile fired by each weapon.
+PROJECTILE_SIZES = {
+    "cannon": (35, 35),
+    "pistol": (30, 20),
+}
+
+# Longest time a projectile of each type may stay in flight.
+PROJECTILE_LIFETIMES = {
+    CANNON: CANNON_LIFETIME,
+    PISTOL: PISTOL_LIFETIME,
+    PISTOL_HIT_STONE: PISTOL_LIFETIME,
+}
+
+# Projectiles are culled once they have left this box for good.
+WORLD_BOUNDS = (0, 0, SCREEN_WIDTH, SCREEN_HEIGHT)
+
+
+# Path of one laser shot: the polyline the beam follows and what it touched along the way, as
+# (kind, point) pairs with kind one of "mirror", "target", "stone" or "perpetito".
+class Beam:
+    def __init__(self, origin):
+        self.points = [origin]
+        self.hits = []
+
+    def length(self):
+        return sum(math.dist(a, b) for a, b in zip(self.points, self.points[1:]))
+
+
+class World:
+
+    def __init__(self, on_target_hit=None, on_stone_hit=None, on_mirror_hit=None, perpetitos=1, seed=None,
+                 on_fire=None):
+        # Callbacks receive the bullet position of the hit, after score and respawn are applied.
+        self.on_target_hit = on_target_hit
+        self.on_stone_hit = on_stone_hit
+        self.on_mirror_hit = on_mirror_hit
+        self.on_fire = on_fire  # Receives what fire() returns, whether the player or a replay fired
+        self.seed = seed
+        self.rng = random.Random(seed)
+
+        self.weapons = {
+            "cannon": Box((10, 40), (150, 67)),
+            "pistol": Box((10, 40), (150, 50)),
+            "laser": Box((10, 40), (150, 50)),
+        }
+        self.target = Box((800, 300), (100, 100))
+        self.stone = Box((600, 200), (100, 100))
+        self.mirror = Box((400, 250), (100, 100))
+        self.perpetitos = [Box(self.random_position(), (100, 100)) for _ in range(perpetitos)]
+
+        # Obstacles in hit priority order; impact_box in the projectile buffer indexes this list.
+        self.boxes = [self.target, self.stone, self.mirror] + self.perpetitos
+
+        # Broad phase for laser beams, keyed by index in self.boxes; boxes re-bucket themselves when
+        # they are moved. Projectiles skip it: a trajectory's bounding box spans most of the field, so
+        # every shot is solved against every obstacle in one batched call instead (see _solve).
+        self.grid = UniformGrid()
+        for index, box in enumerate(self.boxes):
+            self.grid.insert(index, box.rect())
+            box.on_move = self.obstacle_moved
+
+        self.projectiles = ProjectileBuffer()
+        self.tick_dt = 1 / TICK_RATE
+        self.accumulator = 0.0
+        self.tick = 0
+        self.clock = 0.0  # Simulation time of the event being handled, or of the last tick
+        self.score = 0
+        self.shots = 0
+        self.hits = 0
+        self.shot_log = ShotLog()
+        self.contact_tests = 0  # Shot/obstacle pairs solved so far, for the profiler
+        self.end_tick = GAME_TIME * TICK_RATE
+
+        # Gun controls. They only change through set_rotation, set_weapon, set_speed and fire, which
+        # report each change to recorder(tick, input, value) when one is set; a script (a replay
+        # Player) gets to feed its inputs before every tick.
+        self.angle = 0.0
+        self.rotation = 0
+        self.weapon = "cannon"
+        self.bullet_speed = 300
+        self.recorder = None
+        self.script = None
+
+    def obstacle_moved(self, box):
+        index = self.boxes.index(box)
+        self.grid.move(index, box.rect())
+        self._reschedule_for(index)
+
+    # Generate a random position within screen boundaries
+    def random_position(self):
+        return (self.rng.randint(200, SCREEN_WIDTH - 200), self.rng.randint(200, SCREEN_HEIGHT - 200))
+
+    def reset_stats(self):
+        self.score = 0
+        self.shots = 0
+        self.hits = 0
+        self.shot_log.clear()
+
+    # Back to an empty field at time zero, for a new game of GAME_TIME played with the given seed (a
+    # shorter or longer game sets end_tick after this). The gun keeps its weapon and speed but points
+    # straight ahead again.
+    def reset(self, seed=None):
+        self.seed = seed
+        self.rng.seed(seed)
+        self.projectiles.clear()
+        self.accumulator = 0.0
+        self.tick = 0
+        self.end_tick = GAME_TIME * TICK_RATE
+        self.clock = 0.0
+        self.reset_stats()
+        self.angle = 0.0
+        self.rotation = 0
+        self.script = None
+        self.target.pos = (800, 300)
+        self.stone.pos = (600, 200)
+        self.mirror.pos = (400, 250)
+        self.respawn_perpetitos()
+
+    @property
+    def over(self):
+        return self.tick >= self.end_tick
+
+    def _record(self, input, value=0):
+        if self.recorder is not None:
+            self.recorder(self.tick, input, value)
+
+    # Held rotation direction: -1 turns the gun down, 1 up, 0 stops it. Applied once per tick.
+    def set_rotation(self, direction):
+        if direction != self.rotation:
+            self.rotation = direction
+            self._record(ROTATE, direction)
+
+    def set_weapon(self, weapon):
+        if weapon != self.weapon:
+            self.weapon = weapon
+            self._record(WEAPON, WEAPONS.index(weapon))
+
+    # Clamps speed to MIN_SPEED..MAX_SPEED, so any typed value can be recorded and replayed exactly.
+    def set_speed(self, speed):
+        speed = min(max(int(speed), MIN_SPEED), MAX_SPEED)
+        if speed != self.bullet_speed:
+            self.bullet_speed = speed
+            self._record(SPEED, speed)
+
+    # Fires the current weapon at the current angle; returns what shoot() returns, or None once the
+    # game is over.
+    def fire(self):
+        if self.over:
+            return None
+        self._record(FIRE)
+        shot = self.shoot(self.weapon, self.angle, self.bullet_speed)
+        if self.on_fire:
+            self.on_fire(shot)
+        return shot
+
+    # Replays one recorded input.
+    def apply(self, input, value):
+        if input == ROTATE:
+            self.set_rotation(int(value))
+        elif input == WEAPON:
+            self.set_weapon(WEAPONS[int(value)])
+        elif input == SPEED:
+            self.set_speed(int(value))
+        elif input == FIRE:
+            self.fire()
+
+    # Bottom-left corner of a projectile leaving the muzzle of weapon at angle.
+    def muzzle(self, weapon, angle):
+        angle_rad = math.radians(angle)
+        gun = self.weapons[weapon]
+        return (gun.pos[0] + gun.size[0] / 2 + math.cos(angle_rad) * gun.size[0] / 2,
+                gun.pos[1] + gun.size[1] / 2 + math.sin(angle_rad) * gun.size[0] / 2)
+
+    # Launch speed and gravity of a weapon; speed only applies to the cannon. Pistol shots travel
+    # in a straight line at PISTOL_BULL, the hitscan laser only needs a straight-line aim.
+    def ballistics(self, weapon, speed):
+        if weapon == "cannon":
+            return speed, GRAVITY
+        return PISTOL_BULL, 0
+
+    # Fires a projectile from the muzzle of the given weapon and schedules its first impact.
+    # The laser is resolved on the spot and returns its Beam instead of a projectile id.
+    def shoot(self, weapon, angle, speed):
+        if weapon == "laser":
+            return self.fire_laser(angle)
+        self.shots += 1
+        speed, gravity = self.ballistics(weapon, speed)
+        angle_rad = math.radians(angle)
+        velocity = (speed * math.cos(angle_rad), speed * math.sin(angle_rad))
+        sprite_angle = 0 if weapon == "cannon" else angle  # Cannon balls are round, they are drawn unrotated
+
+        shot = self.shot_log.record(self.clock, weapon, angle, speed)
+        buf = self.projectiles
+        i = buf.add(self.muzzle(weapon, angle), velocity, gravity, self.clock, PROJECTILE_SIZES[weapon], weapon,
+                    sprite_angle, shot)
+        exit = exit_time(buf.origin[i], buf.vel0[i], gravity, buf.size[i], WORLD_BOUNDS)
+        buf.expire_t[i] = self.clock + min(float(exit), PROJECTILE_LIFETIMES[buf.type[i]])
+        self._schedule(np.array([i]))
+        return buf.ids[i]
+
+    # Launch angles that put the centre of a weapon's projectile through point, low arc first.
+    # Aim previews and bots can feed the result straight into shoot().
+    def aim(self, weapon, point, speed=None):
+        speed, gravity = self.ballistics(weapon, speed)
+        size = PROJECTILE_SIZES.get(weapon, (0, 0))  # The laser beam has no size
+        angles = []
+        for branch in (0, 1):
+            angle = 0.0
+            for _ in range(AIM_ITERATIONS):
+                start = self.muzzle(weapon, angle)
+                solutions = launch_angles(point[0] - size[0] / 2 - start[0], point[1] - size[1] / 2 - start[1],
+                                          speed, gravity)
+                if not solutions:
+                    break
+                angle = solutions[min(branch, len(solutions) - 1)]
+            else:
+                if not any(abs(angle - other) < 1e-6 for other in angles):
+                    angles.append(angle)
+        return angles
+
+    # Hitscan laser: casts a ray from the muzzle and follows its reflections off the mirror until
+    # it hits something else, runs out of LASER_DIST or has bounced LASER_BOUNCES times. The hits
+    # are applied once the whole path is known, so the target respawning cannot bend the beam.
+    # The shot log records the laser as resolved at once, by whatever stopped the beam.
+    def fire_laser(self, angle):
+        self.shots += 1
+        shot = self.shot_log.record(self.clock, "laser", angle, 0)
+        angle_rad = math.radians(angle)
+        direction = np.array([math.cos(angle_rad), math.sin(angle_rad)])
+        origin = np.array(self.muzzle("laser", angle), dtype=float)
+        beam = Beam(tuple(origin.tolist()))
+        remaining = LASER_DIST
+
+        for bounce in range(LASER_BOUNCES + 1):
+            end = origin + direction * remaining
+            lo, hi = np.minimum(origin, end), np.maximum(origin, end)
+            # Only the boxes sharing a cell with the segment are ray cast, in hit priority order.
+            nearby = sorted(self.grid.query((lo[0], lo[1], hi[0] - lo[0], hi[1] - lo[1])))
+            boxes = [self.boxes[index] for index in nearby]
+            hit = None
+            if boxes:
+                self.contact_tests += len(boxes)
+                rects = np.array([box.rect() for box in boxes], dtype=float)
+                # A ray is a zero-sized shot moving at unit speed, so contact times are distances.
+                dist, axis = first_contact(origin, direction, 0.0, (0, 0), rects.T)
+                k = int(np.argmin(dist))
+                if dist[k] <= remaining:
+                    hit = (float(dist[k]), int(axis[k]), boxes[k])
+            if hit is None:
+                beam.points.append(tuple(end.tolist()))
+                break
+
+            dist, axis, box = hit
+            point = origin + direction * dist
+            beam.points.append(tuple(point.tolist()))
+            if box is not self.mirror:
+                beam.hits.append((self.box_kind(box), beam.points[-1]))
+                break
+            beam.hits.append(("mirror", beam.points[-1]))
+            direction[axis] = -direction[axis]
+            origin = point
+            remaining -= dist
+
+        stopped = [kind for kind, point in beam.hits if kind != "mirror"]
+        self.shot_log.resolve(shot, OUTCOME_CODES[stopped[0]] if stopped else MISS, self.clock)
+        for kind, point in beam.hits:
+            if kind == "target":
+                self.target_hit(point)
+        return beam
+
+    def box_kind(self, box):
+        if box is self.target:
+            return "target"
+        if box is self.stone:
+            return "stone"
+        if box is self.mirror:
+            return "mirror"
+        return "perpetito"
+
+    # Earliest contact of rows (from the current clock on) with every obstacle; ties go to the
+    # first box in self.boxes, i.e. target, then stone, then mirror, then perpetitos.
+    def _schedule(self, rows):
+        if len(rows) == 0:
+            return
+        with profiler.phase('collisions'):
+            self._solve(rows)
+
+    def _solve(self, rows):
+        self.contact_tests += len(rows) * len(self.boxes)
+        buf = self.projectiles
+        rects = np.array([box.rect() for box in self.boxes], dtype=float)
+        t0 = buf.t0[rows]
+        t, axis = first_contact(buf.origin[rows, None, :], buf.vel0[rows, None, :], buf.gravity[rows, None],
+                                buf.size[rows, None, :], rects.T[:, None, :], (self.clock - t0)[:, None])
+        box = np.argmin(t, axis=1)
+        first = t[np.arange(len(rows)), box]
+        hit = np.isfinite(first)
+        buf.impact_t[rows] = np.where(hit, t0 + first, np.inf)
+        buf.impact_box[rows] = np.where(hit, box, -1)
+        buf.impact_axis[rows] = axis[np.arange(len(rows)), box]
+
+    # An obstacle moved: shots that were heading for it are solved again against everything, all
+    # other shots only need to know whether the box's new place now comes first.
+    def _reschedule_for(self, index):
+        if self.projectiles.count == 0:
+            return
+        with profiler.phase('collisions'):
+            self._resolve_for(index)
+
+    def _resolve_for(self, index):
+        buf = self.projectiles
+        n = buf.end
+        alive = buf.alive[:n]
+        rerun = np.flatnonzero(alive & (buf.impact_box[:n] == index))
+        if len(rerun):
+            self._solve(rerun)
+
+        rows = np.flatnonzero(alive & (buf.impact_box[:n] != index))
+        if len(rows) == 0:
+            return
+        self.contact_tests += len(rows)
+        t0 = buf.t0[rows]
+        t, axis = first_contact(buf.origin[rows], buf.vel0[rows], buf.gravity[rows], buf.size[rows],
+                                self.boxes[index].rect(), self.clock - t0)
+        t = t0 + t
+        current = buf.impact_t[rows]
+        sooner = (t < current) | ((t == current) & (index < buf.impact_box[rows]))
+        rows, t, axis = rows[sooner], t[sooner], np.broadcast_to(axis, sooner.shape)[sooner]
+        buf.impact_t[rows] = t
+        buf.impact_box[rows] = index
+        buf.impact_axis[rows] = axis
+
+    # Runs as many fixed ticks as the elapsed real time covers, whatever the render rate is.
+    # Leftover time is carried to the next call; returns the number of ticks run.
+    def advance(self, elapsed):
+        self.accumulator += elapsed
+        ticks = 0
+        while self.accumulator >= self.tick_dt and ticks < MAX_TICKS_PER_FRAME and not self.over:
+            self.run_tick()
+            self.accumulator -= self.tick_dt
+            ticks += 1
+        if ticks == MAX_TICKS_PER_FRAME:
+            self.accumulator = min(self.accumulator, self.tick_dt)
+        return ticks
+
+    # Fraction of a tick since the last step, for drawing between two simulated states.
+    @property
+    def alpha(self):
+        return min(self.accumulator / self.tick_dt, 1.0)
+
+    @property
+    def time(self):
+        return self.tick * self.tick_dt
+
+    # Projectile positions between the last tick and the next one, rows match projectiles[:end].
+    # A shot is never drawn past its scheduled impact or expiry.
+    def render_positions(self):
+        buf = self.projectiles
+        n = buf.end
+        t = np.minimum(self.time + self.alpha * self.tick_dt, np.minimum(buf.impact_t[:n], buf.expire_t[:n]))
+        return buf.positions(t)
+
+    # One tick of the game: scripted inputs for the current tick, then the step to the next one.
+    def run_tick(self):
+        if self.script:
+            self.script.feed(self)
+        self.step()
+
+    # Advances the clock by one tick and handles, in time order, every impact and expiry scheduled
+    # inside it, then turns the gun by the held rotation. Nothing is integrated: positions come from
+    # the closed-form trajectories.
+    def step(self):
+        self.tick += 1
+        now = self.time
+        buf = self.projectiles
+        while buf.count:
+            n = buf.end
+            due = np.minimum(buf.impact_t[:n], buf.expire_t[:n])
+            i = int(np.argmin(due))
+            if not due[i] <= now:
+                break
+            self.clock = due[i]
+            if buf.expire_t[i] <= buf.impact_t[i]:
+                self.shot_log.resolve(buf.shot[i], MISS, self.clock)
+                buf.kill(i)  # Left the screen for good or outlived its weapon's lifetime
+            else:
+                self._impact(i)
+        self.clock = now
+        if self.rotation:
+            self.angle = min(max(self.angle + self.rotation * ROTATE_SPEED * self.tick_dt, MIN_ANGLE), MAX_ANGLE)
+
+    def _impact(self, i):
+        buf = self.projectiles
+        box = self.boxes[buf.impact_box[i]]
+        axis = buf.impact_axis[i]
+        pos = buf.position_of(i, self.clock)
+        bullet_pos = (float(pos[0]), float(pos[1]))
+        type = buf.type[i]
+        self.shot_log.resolve(buf.shot[i], OUTCOME_CODES[self.box_kind(box)], self.clock)
+        if box is self.target:
+            buf.kill(i)
+            self.target_hit(bullet_pos)
+        elif box is self.stone:
+            if type == CANNON:
+                buf.kill(i)
+                self.stone_hit(bullet_pos)
+            elif type == PISTOL:
+                # Marked by the stone and dropped one tick later, unless the stone moves away first
+                buf.type[i] = PISTOL_HIT_STONE
+                buf.impact_t[i] = self.clock + self.tick_dt
+            else:
+                buf.kill(i)
+        elif box is self.mirror:
+            buf.kill(i)
+            self.mirror_hit(bullet_pos)
+        else:
+            buf.kill(i)  # Perpetitos absorb everything
+
+    # Hit rules: update the score, move the object that was hit and notify the listener.
+    def target_hit(self, pos):
+        self.score += 1
+        self.hits += 1
+        self.respawn_target()
+        if self.on_target_hit:
+            self.on_target_hit(pos)
+
+    def stone_hit(self, pos):
+        self.respawn_stone()
+        if self.on_stone_hit:
+            self.on_stone_hit(pos)
+
+    def mirror_hit(self, pos):
+        self.respawn_mirror()
+        if self.on_mirror_hit:
+            self.on_mirror_hit(pos)
+
+    def respawn_target(self):
+        self.target.pos = self.random_position()
+
+    def respawn_stone(self):
+        self.stone.pos = self.random_position()
+
+    def respawn_mirror(self):
+        self.mirror.pos = self.random_position()
+
+    def respawn_perpetitos(self):
+        for perpetito in self.perpetitos:
+            perpetito.pos = self.random_position()
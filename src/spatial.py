@@ -0,0 +1,52 @@
+import math
+
+from constants import *
+
+
+# Uniform-grid broad phase over the play field. Obstacles are registered once and re-bucketed only
+# when they move; the laser queries it with the bounding box of each beam segment before any exact
+# test runs. Anything outside the field is clamped to the border cells, which can only add
+# candidates, never lose them, because the exact test always follows.
+class UniformGrid:
+
+    def __init__(self, width=SCREEN_WIDTH, height=SCREEN_HEIGHT, cell_size=128):
+        self.cell_size = cell_size
+        self.nx = math.ceil(width / cell_size)
+        self.ny = math.ceil(height / cell_size)
+        self.cells = [set() for _ in range(self.nx * self.ny)]
+        self.cells_of = {}
+
+    def _cell_range(self, rect):
+        x, y, w, h = rect
+        cx0 = min(max(int(x // self.cell_size), 0), self.nx - 1)
+        cx1 = min(max(int((x + w) // self.cell_size), 0), self.nx - 1)
+        cy0 = min(max(int(y // self.cell_size), 0), self.ny - 1)
+        cy1 = min(max(int((y + h) // self.cell_size), 0), self.ny - 1)
+        return [cy * self.nx + cx for cy in range(cy0, cy1 + 1) for cx in range(cx0, cx1 + 1)]
+
+    def insert(self, key, rect):
+        cells = self._cell_range(rect)
+        for cell in cells:
+            self.cells[cell].add(key)
+        self.cells_of[key] = cells
+
+    def remove(self, key):
+        for cell in self.cells_of.pop(key, ()):
+            self.cells[cell].discard(key)
+
+    # Re-buckets a moved obstacle, skipping all work when it stays in the same cells.
+    def move(self, key, rect):
+        if self._cell_range(rect) == self.cells_of.get(key):
+            return
+        self.remove(key)
+        self.insert(key, rect)
+
+    # Keys of every obstacle sharing a cell with rect.
+    def query(self, rect):
+        cells = self._cell_range(rect)
+        if len(cells) == 1:
+            return self.cells[cells[0]]
+        keys = set()
+        for cell in cells:
+            keys |= self.cells[cell]
+        return keys
@@ -0,0 +1,121 @@
+import csv
+import json
+import math
+import sys
+
+from storage import ScoreStore, get_store
+
+EXPORT_BATCH = 500  # Rows fetched per round trip while exporting
+
+# Full tables that can be exported, oldest row first.
+EXPORT_QUERIES = {
+    'scores': 'SELECT id, score, date, shots, hits, accuracy, replay_id FROM scores ORDER BY id',
+    'shots': 'SELECT id, game_id, t, weapon, angle, speed, outcome, flight_time FROM shots ORDER BY id',
+}
+
+PERIOD_QUERIES = {
+    'day': '''SELECT day, games, shots, hits, total_score, best_score FROM daily_stats
+              ORDER BY day DESC LIMIT ?''',
+    'week': '''SELECT week, games, shots, hits, total_score, best_score FROM weekly_stats
+               ORDER BY week DESC LIMIT ?''',
+}
+
+
+# Score history statistics. Everything here reads the summary tables that the scores_summaries
+# trigger keeps current on every insert (see MIGRATIONS in storage.py), so the cost of a query
+# depends on the number of days, weeks and distinct scores, never on the number of games.
+class Stats:
+
+    def __init__(self, store=None):
+        self.store = store or get_store()
+
+    # (games, shots, hits, accuracy, average score, best score) over every game.
+    def totals(self):
+        games, shots, hits, total, best = self.store.conn.execute(
+            'SELECT SUM(games), SUM(shots), SUM(hits), SUM(total_score), MAX(best_score) FROM daily_stats').fetchone()
+        if not games:
+            return 0, 0, 0, 0.0, 0.0, 0
+        return games, shots, hits, hits / shots if shots else 0.0, total / games, best
+
+    # (period, games, accuracy, average score, best score) rows for the latest limit days or weeks,
+    # newest first. Accuracy is hits over shots across the whole period.
+    def trend(self, period='day', limit=7):
+        return [(key, games, hits / shots if shots else 0.0, total / games, best)
+                for key, games, shots, hits, total, best
+                in self.store.conn.execute(PERIOD_QUERIES[period], (limit,))]
+
+    # {rank: score} nearest-rank percentiles of the score over every game, exact since scores are integers.
+    def percentiles(self, ranks=(50, 90, 99)):
+        counts = self.store.conn.execute('SELECT score, games FROM score_counts ORDER BY score').fetchall()
+        games = sum(count for score, count in counts)
+        result = {}
+        if not games:
+            return result
+        targets = sorted(ranks)
+        seen = 0
+        for score, count in counts:
+            seen += count
+            while targets and seen >= math.ceil(targets[0] / 100 * games):
+                result[targets.pop(0)] = score
+        return result
+
+    # [(low, high, games)] score histogram in at most bins equal-width bins covering every score recorded.
+    def score_histogram(self, bins=10):
+        counts = self.store.conn.execute('SELECT score, games FROM score_counts ORDER BY score').fetchall()
+        if not counts:
+            return []
+        low, high = counts[0][0], counts[-1][0]
+        width = max(1, math.ceil((high - low + 1) / bins))
+        histogram = [[low + i * width, low + (i + 1) * width - 1, 0] for i in range(math.ceil((high - low + 1) / width))]
+        for score, count in counts:
+            histogram[(score - low) // width][2] += count
+        return [tuple(row) for row in histogram]
+
+    # Games per accuracy decile, [0.0, 0.1) first; perfect games count in the last one.
+    def accuracy_histogram(self):
+        histogram = [0] * 10
+        for bucket, games in self.store.conn.execute('SELECT bucket, games FROM accuracy_counts'):
+            histogram[bucket] = games
+        return histogram
+
+
+# Rows of an exportable table, fetched EXPORT_BATCH at a time so a whole table is never in memory.
+def export_rows(store, table):
+    cursor = store.conn.execute(EXPORT_QUERIES[table])
+    columns = [description[0] for description in cursor.description]
+    return columns, _fetch(cursor)
+
+
+def _fetch(cursor):
+    while True:
+        batch = cursor.fetchmany(EXPORT_BATCH)
+        if not batch:
+            return
+        yield from batch
+
+
+def export_csv(store, table, out):
+    columns, rows = export_rows(store, table)
+    writer = csv.writer(out)
+    writer.writerow(columns)
+    writer.writerows(rows)
+
+
+# Writes a JSON array of one object per row, one row at a time.
+def export_json(store, table, out):
+    columns, rows = export_rows(store, table)
+    out.write('[')
+    for i, row in enumerate(rows):
+        out.write(',\n' if i else '\n')
+        out.write(json.dumps(dict(zip(columns, row))))
+    out.write('\n]\n')
+
+
+EXPORTERS = {'csv': export_csv, 'json': export_json}
+
+
+# Usage: python src/stats.py {csv|json} {scores|shots} > file
+if __name__ == '__main__':
+    store = ScoreStore()
+    EXPORTERS[sys.argv[1]](store, sys.argv[2], sys.stdout)
+    store.close()
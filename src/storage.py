@@ -1,26 +1,278 @@
-import sqlite3 
-
-def create_table():
-    # Connect to the SQLite database named 'scores.db'
-    # If the database does not exist, it will be created
-    conn = sqlite3.connect('scores.db')
-    
-    # Create a cursor object which allows us to execute SQL commands
-    cursor = conn.cursor()
-    
-    # Execute a SQL command to create a table named 'scores' if it does not already exist
-    # The table has columns: id (integer primary key), score (integer), date (text),
-    # shots (integer), hits (integer), and accuracy (real number)
-    cursor.execute('''CREATE TABLE IF NOT EXISTS scores
-                      (id INTEGER PRIMARY KEY, 
-                       score INTEGER, 
-                       date TEXT, 
-                       shots INTEGER, 
-                       hits INTEGER, 
-                       accuracy REAL)''')
-    
-    # Commit the changes to the database
-    conn.commit()
-    
-    # Close the connection to the database
-    conn.close()
+import logging
+import os
+import queue
+import sqlite3
+import threading
+from datetime import datetime
+
+# scores.db lives in the project root, next to assets/, whatever the working directory is.
+DB_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scores.db')
+
+# Schema migrations, applied in order. PRAGMA user_version records how many have already run,
+# so each one runs exactly once per database file.
+MIGRATIONS = [
+    # 1: the scores table, one row per finished game
+    '''CREATE TABLE IF NOT EXISTS scores
+       (id INTEGER PRIMARY KEY,
+        score INTEGER,
+        date TEXT,
+        shots INTEGER,
+        hits INTEGER,
+        accuracy REAL)''',
+    # 2: serves the leaderboard ORDER BY accuracy DESC, score DESC straight from the index
+    'CREATE INDEX IF NOT EXISTS idx_scores_accuracy_score ON scores (accuracy, score)',
+    # 3: per-shot telemetry, one row per shot fired, keyed by the game (scores.id) it belongs to
+    '''CREATE TABLE IF NOT EXISTS shots
+       (id INTEGER PRIMARY KEY,
+        game_id INTEGER REFERENCES scores (id),
+        t REAL,
+        weapon TEXT,
+        angle REAL,
+        speed REAL,
+        outcome TEXT,
+        flight_time REAL)''',
+    # 4: looks up the shots of one game
+    'CREATE INDEX IF NOT EXISTS idx_shots_game_id ON shots (game_id)',
+    # 5-8: materialized summaries of the scores table, read by stats.py instead of scanning it
+    '''CREATE TABLE IF NOT EXISTS daily_stats
+       (day TEXT PRIMARY KEY,
+        games INTEGER,
+        shots INTEGER,
+        hits INTEGER,
+        total_score INTEGER,
+        best_score INTEGER)''',
+    '''CREATE TABLE IF NOT EXISTS weekly_stats
+       (week TEXT PRIMARY KEY,
+        games INTEGER,
+        shots INTEGER,
+        hits INTEGER,
+        total_score INTEGER,
+        best_score INTEGER)''',
+    'CREATE TABLE IF NOT EXISTS score_counts (score INTEGER PRIMARY KEY, games INTEGER)',
+    'CREATE TABLE IF NOT EXISTS accuracy_counts (bucket INTEGER PRIMARY KEY, games INTEGER)',
+    # 9-12: fill the summaries from the games already stored
+    '''INSERT OR REPLACE INTO daily_stats
+       SELECT substr(date, 1, 10), COUNT(*), SUM(shots), SUM(hits), SUM(score), MAX(score)
+       FROM scores GROUP BY substr(date, 1, 10)''',
+    '''INSERT OR REPLACE INTO weekly_stats
+       SELECT strftime('%Y-W%W', date), COUNT(*), SUM(shots), SUM(hits), SUM(score), MAX(score)
+       FROM scores GROUP BY strftime('%Y-W%W', date)''',
+    'INSERT OR REPLACE INTO score_counts SELECT score, COUNT(*) FROM scores GROUP BY score',
+    '''INSERT OR REPLACE INTO accuracy_counts
+       SELECT MIN(CAST(accuracy * 10 AS INTEGER), 9), COUNT(*) FROM scores
+       GROUP BY MIN(CAST(accuracy * 10 AS INTEGER), 9)''',
+    # 13: keeps the summaries current, one upsert per summary for every new game
+    '''CREATE TRIGGER IF NOT EXISTS scores_summaries AFTER INSERT ON scores
+       BEGIN
+           INSERT INTO daily_stats VALUES (substr(NEW.date, 1, 10), 1, NEW.shots, NEW.hits, NEW.score, NEW.score)
+           ON CONFLICT (day) DO UPDATE SET games = games + 1, shots = shots + NEW.shots, hits = hits + NEW.hits,
+               total_score = total_score + NEW.score, best_score = MAX(best_score, NEW.score);
+           INSERT INTO weekly_stats VALUES (strftime('%Y-W%W', NEW.date), 1, NEW.shots, NEW.hits, NEW.score, NEW.score)
+           ON CONFLICT (week) DO UPDATE SET games = games + 1, shots = shots + NEW.shots, hits = hits + NEW.hits,
+               total_score = total_score + NEW.score, best_score = MAX(best_score, NEW.score);
+           INSERT INTO score_counts VALUES (NEW.score, 1)
+           ON CONFLICT (score) DO UPDATE SET games = games + 1;
+           INSERT INTO accuracy_counts VALUES (MIN(CAST(NEW.accuracy * 10 AS INTEGER), 9), 1)
+           ON CONFLICT (bucket) DO UPDATE SET games = games + 1;
+       END''',
+    # 14: id of the game's replay file (see replay.py), NULL for games played before replays existed
+    'ALTER TABLE scores ADD COLUMN replay_id TEXT',
+]
+
+# Statements are kept as constants so sqlite3's statement cache always sees the same text
+# and reuses the prepared statement.
+INSERT_SCORE = 'INSERT INTO scores (score, date, shots, hits, accuracy, replay_id) VALUES (?, ?, ?, ?, ?, ?)'
+INSERT_SHOT = 'INSERT INTO shots (game_id, t, weapon, angle, speed, outcome, flight_time) VALUES (?, ?, ?, ?, ?, ?, ?)'
+# Leaderboard pages, best first. Pages after the first seek past the last row shown by its
+# (accuracy, score, id) key instead of using OFFSET, so any page costs the same as the first one;
+# the (accuracy, score) index also carries id, the rowid, so both are served from it without sorting.
+SCORES_FIRST_PAGE = '''SELECT id, score, date, shots, hits, accuracy FROM scores
+                       ORDER BY accuracy DESC, score DESC, id DESC LIMIT ?'''
+SCORES_PAGE_AFTER = '''SELECT id, score, date, shots, hits, accuracy FROM scores
+                       WHERE (accuracy, score, id) < (?, ?, ?)
+                       ORDER BY accuracy DESC, score DESC, id DESC LIMIT ?'''
+
+WRITE_QUEUE_SIZE = 256  # Pending writes before submit() rejects (or, with wait, blocks on) new ones
+WRITE_BATCH_SIZE = 64  # Most writes committed in one transaction
+
+logger = logging.getLogger(__name__)
+
+
+# The (score, date, shots, hits, accuracy) values stored for one finished game.
+def score_values(score, shots, hits, date=None):
+    accuracy = hits / shots if shots > 0 else 0
+    date = date or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    return score, date, shots, hits, accuracy
+
+
+# Owns the one long-lived connection to the scores database.
+class ScoreStore:
+
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        self.conn = sqlite3.connect(path, cached_statements=64)
+        # WAL lets readers run alongside the writer; NORMAL sync is durable enough for WAL mode.
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.migrate()
+
+    def migrate(self):
+        version = self.conn.execute('PRAGMA user_version').fetchone()[0]
+        for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            with self.conn:
+                self.conn.execute(migration)
+                self.conn.execute(f'PRAGMA user_version = {number}')
+
+    # Inserts a game's score_values(), its replay id and its shot rows without committing; returns the
+    # stored (id, score, date, shots, hits, accuracy) row.
+    def insert_game(self, values, shot_rows=(), replay_id=None):
+        game_id = self.conn.execute(INSERT_SCORE, (*values, replay_id)).lastrowid
+        self.conn.executemany(INSERT_SHOT, ((game_id, *row) for row in shot_rows))
+        return (game_id, *values)
+
+    # (id, score, date, shots, hits, accuracy) rows, best accuracy first, then best score.
+    def top_scores(self, limit=10):
+        return self.scores_page(None, limit)
+
+    # The next limit leaderboard rows after the row with key after = (accuracy, score, id),
+    # or the first limit rows when after is None.
+    def scores_page(self, after=None, limit=10):
+        if after is None:
+            return self.conn.execute(SCORES_FIRST_PAGE, (limit,)).fetchall()
+        return self.conn.execute(SCORES_PAGE_AFTER, (*after, limit)).fetchall()
+
+    def close(self):
+        self.conn.close()
+
+
+# Write-behind persistence. Writes are queued from the UI thread and applied by one background
+# thread with its own connection, several per transaction; WAL mode keeps the UI's reads unblocked.
+# Each write is a function of the writer's ScoreStore; its result (None if it failed) is handed to
+# the optional callback through dispatch, which the app points at the Kivy main thread. The thread
+# outlives any failure, an unopenable database included, so the queue always drains and the UI never
+# waits on it.
+class ScoreWriter:
+
+    def __init__(self, path=DB_PATH, dispatch=None):
+        self.path = path
+        self.dispatch = dispatch or (lambda callback, result: callback(result))
+        self.queue = queue.Queue(WRITE_QUEUE_SIZE)
+        self.thread = threading.Thread(target=self._run, name='score-writer', daemon=True)
+        self.thread.start()
+
+    # Queues a write. When the queue is full the write is dropped and its callback gets None, unless
+    # wait is set: then the caller (never the UI thread) blocks until there is room.
+    def submit(self, write, callback=None, wait=False):
+        try:
+            self.queue.put((write, callback), block=wait)
+        except queue.Full:
+            logger.error('Score write queue is full, dropping a write')
+            if callback:
+                self.dispatch(callback, None)
+
+    # Queues a finished game; the date is taken now, not when the row is written. The callback gets
+    # the stored (id, score, date, shots, hits, accuracy) row. shot_rows, if given, is a sequence of
+    # (t, weapon, angle, speed, outcome, flight_time) tuples written in the same transaction, and
+    # replay_id names the game's replay file.
+    def save_score(self, score, shots, hits, callback=None, shot_rows=(), replay_id=None, wait=False):
+        values = score_values(score, shots, hits)
+        self.submit(lambda store: store.insert_game(values, shot_rows, replay_id), callback, wait)
+
+    # The writer's store, opened on first use and again after a failed open; None while it cannot be.
+    def _open(self, store):
+        if store is not None:
+            return store
+        try:
+            return ScoreStore(self.path)
+        except Exception:
+            logger.exception('Cannot open the score database %s', self.path)
+            return None
+
+    def _run(self):
+        store = None
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < WRITE_BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = batch[-1] is None
+            jobs = [job for job in batch if job is not None]
+            store = self._open(store)
+            results = self._write(store, jobs) if store else [None] * len(jobs)
+            for (write, callback), result in zip(jobs, results):
+                if callback:
+                    try:
+                        self.dispatch(callback, result)
+                    except Exception:
+                        logger.exception('Score write callback failed')
+            if stop:
+                if store:
+                    store.close()
+                return
+
+    # Runs a batch in one transaction. If it fails, the writes are retried one by one so a single
+    # bad write only loses itself. Any error counts, not only sqlite3's: writes also touch files
+    # (replays), and one bad write must not stop the thread.
+    def _write(self, store, jobs):
+        try:
+            with store.conn:
+                return [write(store) for write, callback in jobs]
+        except Exception:
+            logger.exception('Batched score write failed, retrying one by one')
+        results = []
+        for write, callback in jobs:
+            try:
+                with store.conn:
+                    results.append(write(store))
+            except Exception:
+                logger.exception('Score write failed')
+                results.append(None)
+        return results
+
+    # Commits what is queued and stops the thread.
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+
+_store = None
+_writer = None
+
+
+# The store shared by every module of the app, opened on first use.
+def get_store():
+    global _store
+    if _store is None:
+        _store = ScoreStore()
+    return _store
+
+
+# Points the shared store and writer at the database at path, closing the current ones first, and
+# returns the store. Without it they open DB_PATH on first use.
+def open_store(path=DB_PATH, dispatch=None):
+    global _store, _writer
+    close_store()
+    _store = ScoreStore(path)
+    _writer = ScoreWriter(path, dispatch)
+    return _store
+
+
+# The app's write-behind queue, started on first use.
+def get_writer(dispatch=None):
+    global _writer
+    if _writer is None:
+        _writer = ScoreWriter(dispatch=dispatch)
+    return _writer
+
+
+# Flushes pending writes and closes every connection, for app exit.
+def close_store():
+    global _store, _writer
+    if _writer is not None:
+        _writer.close()
+        _writer = None
+    if _store is not None:
+        _store.close()
+        _store = None
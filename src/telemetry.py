@@ -0,0 +1,79 @@
+import numpy as np
+
+# Weapon and outcome codes stored in ShotLog; the database keeps the names.
+WEAPON_CODES = {"cannon": 0, "pistol": 1, "laser": 2}
+WEAPON_NAMES = {code: name for name, code in WEAPON_CODES.items()}
+
+IN_FLIGHT = 0  # Not resolved yet (still flying when the game ended)
+MISS = 1  # Left the field or outlived its weapon's lifetime
+OUTCOME_CODES = {"in_flight": IN_FLIGHT, "miss": MISS, "target": 2, "stone": 3, "mirror": 4, "perpetito": 5}
+OUTCOME_NAMES = {code: name for name, code in OUTCOME_CODES.items()}
+
+SHOT_LOG_SIZE = 4096  # Shots kept per game; older ones are overwritten past this
+
+
+# Per-shot telemetry of one game: when a shot was fired (world clock), with which weapon, at what
+# angle and speed, what it ended up touching first and after how long. The columns are preallocated
+# ring buffers, so recording a shot or its outcome is a few scalar writes and never allocates;
+# everything is copied out once, at game over.
+class ShotLog:
+
+    def __init__(self, capacity=SHOT_LOG_SIZE):
+        self.t = np.zeros(capacity)
+        self.weapon = np.zeros(capacity, dtype=np.int8)
+        self.angle = np.zeros(capacity)
+        self.speed = np.zeros(capacity)
+        self.outcome = np.zeros(capacity, dtype=np.int8)
+        self.flight_time = np.zeros(capacity)
+        self.count = 0  # Shots recorded since clear(); the newest is at (count - 1) % capacity
+
+    @property
+    def capacity(self):
+        return len(self.t)
+
+    # Records a shot fired at time t and returns its sequence number, for resolve().
+    def record(self, t, weapon, angle, speed):
+        seq = self.count
+        i = seq % self.capacity
+        self.t[i] = t
+        self.weapon[i] = WEAPON_CODES[weapon]
+        self.angle[i] = angle
+        self.speed[i] = speed
+        self.outcome[i] = IN_FLIGHT
+        self.flight_time[i] = 0
+        self.count += 1
+        return seq
+
+    # Sets the outcome of shot seq at time t. Only the first outcome counts, and shots that have
+    # already been overwritten are ignored.
+    def resolve(self, seq, outcome, t):
+        i = seq % self.capacity
+        if seq < self.count - self.capacity or self.outcome[i] != IN_FLIGHT:
+            return
+        self.outcome[i] = outcome
+        self.flight_time[i] = t - self.t[i]
+
+    def clear(self):
+        self.count = 0
+
+    # Copies of the recorded columns, oldest shot first, keyed by column name.
+    def columns(self):
+        n = min(self.count, self.capacity)
+        order = (np.arange(self.count - n, self.count)) % self.capacity
+        return {name: getattr(self, name)[order] for name in ("t", "weapon", "angle", "speed", "outcome", "flight_time")}
+
+    # Writes the recorded columns to a NumPy .npz archive.
+    def export(self, path):
+        np.savez_compressed(path, **self.columns())
+
+
+# (t, weapon, angle, speed, outcome, flight_time) tuples for the database, from ShotLog.columns().
+# A list, not a generator: the score writer may run a write twice (see ScoreWriter._write), and the
+# retry must store the same rows.
+def shot_rows(columns):
+    return list(zip(columns["t"].tolist(),
+                    [WEAPON_NAMES[code] for code in columns["weapon"].tolist()],
+                    columns["angle"].tolist(),
+                    columns["speed"].tolist(),
+                    [OUTCOME_NAMES[code] for code in columns["outcome"].tolist()],
+                    columns["flight_time"].tolist()))